@@ -15,12 +15,18 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from coffer_task import Task, GS_Tasklist
+from coffer_table import GS_Table, GS_Sheet
+from coffer_dataformat import FFF_GS_Dataformat
+import concurrent.futures
 
 class Collect_Task(Task):
   def __init__(self, task_dict):
     super().__init__(task_dict)
 
 class GS_Collect_Task(Collect_Task):
+  # Number of spreadsheets fetched at the same time
+  workers = 8
+
   def __init__(self, title = None, sheet = None, tab = None, task_dict = None):
     if task_dict:
       super().__init__(task_dict)
@@ -33,9 +39,13 @@ class GS_Collect_Task(Collect_Task):
       #print(f"GS_Collect_Task({self.GS_Tasklist}, {1})")
       self.tasklist = GS_Tasklist('gs', sheet, tab)
 
+  # Fetch the tabs of the subtasks that need a refresh in a thread pool,
+  # all tabs of a spreadsheet in one request, and store each table as
+  # soon as its records arrive
   def run(self, selector = None):
     print(f"GS_Collect_Task.run(selector={selector})")
     subtasks = self.tasklist.get_tasks(selector)
+    sheets = {}
     for subtask in subtasks:
       if not selector or ('Title' in subtask and selector[0] in subtask['Title']):
         #print(f"GS_Collect_Task.run ==> {subtask}")
@@ -46,13 +56,46 @@ class GS_Collect_Task(Collect_Task):
           #print(f"GS_Collect_Task.run({sheet_title}) missing sheetid/tabid '{sheetid}'/'{tabid}', skipping")
           continue
         tableid = f"Coffin#{sheet_title}#{sheetid}#{tabid}"
-        print(f"GS_Collect_Task.run ==> fetching ({tableid})")
         table = GS_Table(tableid, sheetid, tabid, keymapper=FFF_GS_Dataformat.keymapper)
-        num_recs = len(table.read_all())
-        print(f"GS_Collect_Task.run stored {num_recs} records")
+        if table.needs_refresh():
+          sheets.setdefault(sheetid, []).append(table)
+        else:
+          print(f"GS_Collect_Task.run ({tableid}) no refresh needed")
       else:
         pass
         #print(f"GS_Collect_Task.run skipping subtask")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=GS_Collect_Task.workers) as executor:
+      futures = {}
+      for (sheetid, tables) in sheets.items():
+        print(f"GS_Collect_Task.run ==> fetching {len(tables)} tabs from ({sheetid})")
+        futures[executor.submit(GS_Collect_Task.fetch_sheet, sheetid, tables)] = tables
+      for future in concurrent.futures.as_completed(futures):
+        tables = futures[future]
+        try:
+          (modified, tab_records) = future.result()
+        except Exception as ex:
+          print(f"### GS_Collect_Task.run ({tables[0].tab.sheetid}) failed: {ex}")
+          continue
+        for table in tables:
+          table.modified = modified
+          if table.tab.tabid in tab_records:
+            records = tab_records[table.tab.tabid]
+            table.refresh(records, keymapped=True)
+            print(f"GS_Collect_Task.run stored {len(records)} records")
+          else:
+            table.set_refreshed()
+            print(f"GS_Collect_Task.run ({table.tableid}) unchanged")
+
+  # Read the tabs of tables from spreadsheet sheetid, unless the sheet
+  # has not been modified since they were last read. Returns the
+  # modifiedTime of the sheet, and the keymapped records of each tab read.
+  def fetch_sheet(sheetid, tables):
+    sheet = GS_Sheet(sheetid)
+    modified = sheet.read_modified()
+    tabids = [table.tab.tabid for table in tables if table.modified != modified]
+    if not tabids:
+      return (modified, {})
+    return (modified, sheet.read_tabs(tabids, FFF_GS_Dataformat.keymapper))
 
 Task.factory_register('GS_Collect_Task', GS_Collect_Task)
 
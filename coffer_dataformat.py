@@ -63,3 +63,14 @@ class FFF_GS_Dataformat:
 class FFF_Controlsheet_Dataformat:
   freq_key = 'Frequency'
   title_key = 'Title'
+  # The record keys read by each transform (Trafis) and summary (Sumfis)
+  # function, on top of the Columns of the task
+  function_keys = {
+    'isApproved': ['AAPPROVE'],
+    'tISODate': ['EDATE'],
+    'tGoogleLoc': ['ECOUNTRY', 'ECITY', 'ELOCATION', 'GLOC', 'GSTATE', 'GLAT', 'GLON'],
+    'tisRecurringOn': ['EFREQ', 'EDATE'],
+    'sumGroupByCity': ['ECOUNTRY', 'ECITY'],
+    'sumCountCountries': ['ECOUNTRY'],
+    'sumForkRecurringEvents': ['EFREQ', 'EDATE', 'ETIME'],
+  }
@@ -0,0 +1,113 @@
+#   FridaysForFuture Database Collector Function
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import Counter, deque
+from datetime import datetime, timezone
+import threading, time
+
+# An offline stand-in for an authorized gspread client, serving tabs of
+# records from memory, so that collection can be tested and benchmarked
+# without Google. Every call takes latency seconds. If quota is set, at
+# most quota calls are allowed per quota_period seconds, like the Sheets
+# API read quota, and further calls fail. The calls made are counted in
+# stats, and the highest number of concurrent calls in stats['peak'].
+# The Drive modifiedTime of a spreadsheet is moved on with touch().
+#
+# Install with GS_Tab.authorize = lambda scopes: client
+class Fake_Sheets_Client:
+  def __init__(self, sheets, latency = 0.0, quota = None, quota_period = 60.0):
+    self.sheets = sheets
+    self.latency = latency
+    self.quota = quota
+    self.quota_period = quota_period
+    self.modified = {key:"2020-09-25T10:00:00.000Z" for key in sheets}
+    self.http_client = self
+    self.stats = Counter()
+    self.calls = deque()
+    self.active = 0
+    self.lock = threading.Lock()
+
+  def call(self, name):
+    with self.lock:
+      now = time.monotonic()
+      while self.calls and self.calls[0] < now - self.quota_period:
+        self.calls.popleft()
+      if self.quota and len(self.calls) >= self.quota:
+        self.stats['rejected'] += 1
+        raise Exception(f"Fake_Sheets_Client: 429 quota exceeded calling {name}")
+      self.calls.append(now)
+      self.stats[name] += 1
+      self.active += 1
+      self.stats['peak'] = max(self.stats['peak'], self.active)
+    time.sleep(self.latency)
+    with self.lock:
+      self.active -= 1
+
+  def touch(self, key):
+    self.modified[key] = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+
+  def get_file_drive_metadata(self, key):
+    self.call('get_file_drive_metadata')
+    if key not in self.sheets:
+      raise Exception(f"Fake_Sheets_Client: no spreadsheet {key}")
+    return {'id':key, 'modifiedTime':self.modified[key]}
+
+  # The values of each range, a quoted tab title, as a header row and
+  # rows of formatted values without trailing empty cells, like
+  # spreadsheets.values.batchGet
+  def values_batch_get(self, key, ranges, params = None):
+    self.call('values_batch_get')
+    if key not in self.sheets:
+      raise Exception(f"Fake_Sheets_Client: no spreadsheet {key}")
+    value_ranges = []
+    for sheet_range in ranges:
+      title = sheet_range[1:-1].replace("''", "'")
+      if title not in self.sheets[key]:
+        raise Exception(f"Fake_Sheets_Client: 400 unable to parse range {sheet_range}")
+      records = self.sheets[key][title]
+      header = list(dict.fromkeys(name for record in records for name in record))
+      rows = [[str(record.get(name, '')) for name in header] for record in records]
+      for row in rows:
+        while row and row[-1] == '':
+          row.pop()
+      value_ranges += [{'range':sheet_range, 'majorDimension':'ROWS', 'values':[header] + rows}]
+    return {'spreadsheetId':key, 'valueRanges':value_ranges}
+
+  def open_by_key(self, key):
+    self.call('open_by_key')
+    if key not in self.sheets:
+      raise Exception(f"Fake_Sheets_Client: no spreadsheet {key}")
+    return Fake_Spreadsheet(self, key)
+
+class Fake_Spreadsheet:
+  def __init__(self, client, key):
+    self.client = client
+    self.id = key
+
+  def worksheet(self, title):
+    self.client.call('worksheet')
+    if title not in self.client.sheets[self.id]:
+      raise Exception(f"Fake_Sheets_Client: no worksheet {title} in {self.id}")
+    return Fake_Worksheet(self, title)
+
+class Fake_Worksheet:
+  def __init__(self, spreadsheet, title):
+    self.spreadsheet = spreadsheet
+    self.title = title
+
+  def get_all_records(self):
+    self.spreadsheet.client.call('get_all_records')
+    return [dict(record) for record in self.spreadsheet.client.sheets[self.spreadsheet.id][self.title]]
@@ -16,6 +16,23 @@
 
 from coffer_task import Task, Tasklist
 from coffer_table import Table
+from coffer_dataformat import FFF_Controlsheet_Dataformat
+
+# The records of one or more tables. They are read straight from the
+# database cursors, a batch at a time each time the source is iterated,
+# so that only a batch is ever in memory. With a projection, only those
+# keys are read.
+class Table_Source():
+  def __init__(self, table_ids, projection = None):
+    self.table_ids = table_ids
+    self.projection = projection
+
+  def __iter__(self):
+    for table_id in self.table_ids:
+      yield from Table.db[table_id].find({}, self.projection, batch_size=Table.batch_size)
+
+  def __repr__(self):
+    return f"(Table_Source: {', '.join(self.table_ids)})"
 
 class Generate_Task(Task):
   results = {}
@@ -33,6 +50,23 @@ class GS_Generate_Task(Generate_Task):
       super().__init__({'Title': title, '_class':'GS_Generate_Task', 'table_id':table_id})
       self.tasklist = Tasklist(table_id)
 
+  # The projection for reading the records of a subtask: its Columns,
+  # and the keys its Trafis and Sumfis functions read. None, i.e. all
+  # keys, if there are no Columns or a function reads unknown keys.
+  def get_projection(subtask):
+    keys = GS_Generate_Task.split_names(subtask.get('Columns', ''))
+    if not keys:
+      return None
+    for function in GS_Generate_Task.split_names(subtask.get('Trafis', '')) + \
+                    GS_Generate_Task.split_names(subtask.get('Sumfis', '')):
+      if function not in FFF_Controlsheet_Dataformat.function_keys:
+        return None
+      keys += FFF_Controlsheet_Dataformat.function_keys[function]
+    return {key:1 for key in keys}
+
+  def split_names(names):
+    return [name.strip() for name in names.split(',') if name.strip()]
+
   def run(self, selector = None):
     print(f"GS_Generate_Task.run(selector={selector})")
     subtasks = self.tasklist.get_tasks(selector)
@@ -46,20 +80,22 @@ class GS_Generate_Task(Generate_Task):
           continue
         subtask_source = subtask.get('Source', '')
         if subtask_source == "*":
-          records = []
-          for table_id in Table.get_collection_names(name_starts_with="Coffin#"):
+          table_ids = Table.get_collection_names(name_starts_with="Coffin#")
+          for table_id in table_ids:
             print(f"GS_Generate_Task.run adding {table_id}")
-            records += Table(table_id).read_all()
         else:
           print(f"GS_Generate_Task.run getting '{subtask_source}'")
-          records = Generate_Task.results.get(subtask_source, None)
-          if not records:
+          source = Generate_Task.results.get(subtask_source, None)
+          if source is None:
             print(f"(from coffin)")
-            records = Table("Coffin#" + subtask_source).read_all()
+            table_ids = ["Coffin#" + subtask_source]
           else:
             print(f"(from memory)")
-        print(f"GS_Generate_Task.run contains {len(records)} records")
-        Generate_Task.results[subtask['Title']] = records
+            table_ids = source.table_ids
+        # Each subtask reads the keys it needs, the results keep them all
+        records = Table_Source(table_ids, GS_Generate_Task.get_projection(subtask))
+        print(f"GS_Generate_Task.run contains {records}")
+        Generate_Task.results[subtask['Title']] = Table_Source(table_ids)
       else:
         print(f"GS_Generate_Task.run skipping task")
 
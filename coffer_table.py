@@ -15,27 +15,53 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, DeleteMany, WriteConcern
 from oauth2client.service_account import ServiceAccountCredentials
-from collections import MutableMapping
-import gspread
+from collections.abc import MutableMapping
+from collections import Counter
+import gspread, hashlib, json, threading, time
 
 class Table():
   max_age = timedelta(minutes=15)
+  batch_size = 1000
+  mongo_url = 'mongodb://localhost:27017/'
+  pool_size = 10
+  write_concern = WriteConcern(w=1)
+  # Record keys to index, may be overridden by subclasses
+  index_keys = []
+  indexed = set()
 
-  def db_connect(dbid):
+  # Connect to the Mongo database dbid, at mongo_url, or through client,
+  # e.g. a mongomock.MongoClient() for testing
+  def db_connect(dbid, client = None):
     print(f"Table.db_connect()")
-    Table.client = MongoClient('mongodb://localhost:27017/')
-    Table.db = Table.client[dbid]
+    Table.client = client or MongoClient(Table.mongo_url, maxPoolSize=Table.pool_size)
+    Table.db = Table.client.get_database(dbid, write_concern=Table.write_concern)
+    Table.indexed = set()
+    Table.ensure_indexes()
+
+  # Make sure the collections shared by all tables are indexed. Refreshed
+  # docs from before they had a tableid are removed first, as they would
+  # break the unique index.
+  def ensure_indexes():
+    Table.db.refreshed.delete_many({'tableid':{'$exists':False}})
+    Table.db.refreshed.create_index('tableid', unique=True)
 
   def get_collection_names(name_starts_with = ""):
-    return [coll_name for coll_name in Table.db.collection_names(include_system_collections=False) 
+    return [coll_name for coll_name in Table.db.list_collection_names()
       if coll_name.startswith(name_starts_with)]
 
   def __init__(self, tableid):
     self.tableid = tableid
     self.table = Table.db[self.tableid]
-    self.refreshed = Table.db.refreshed.find_one({'tableid':self.tableid})
+    if self.index_keys and self.tableid not in Table.indexed:
+      for key in self.index_keys:
+        self.table.create_index(key)
+      Table.indexed.add(self.tableid)
+    refreshed = Table.db.refreshed.find_one({'tableid':self.tableid})
+    self.refreshed = refreshed['refreshed'] if refreshed else None
+    # When the external source was last modified, if known
+    self.modified = refreshed.get('modified') if refreshed else None
     self.keymapper = None
     #print(f"Table db={self.db} table={self.table} refreshed={self.refreshed}")
 
@@ -43,30 +69,81 @@ class Table():
     # May be overridden/extended by subclasses
     return []
 
-  def refresh_table(self, external_records = None):
+  # Bring the table up to date with the external records. Each record
+  # is stored with a row id made of a fingerprint of its contents and
+  # a count of identical records before it, e.g. '<sha1>-0'. The row
+  # ids of the table, in the order of the external records, are kept
+  # in the fingerprints collection. Only records with new row ids are
+  # inserted, and rows whose ids are gone deleted, all in one bulk
+  # write, so the cost follows the number of changed records, and the
+  # table is never emptied while it is refreshed. Returns the number of
+  # rows inserted or deleted, or None if there were no records.
+  def refresh_table(self, external_records = None, keymapped = False):
     if external_records == None:
       external_records = self.get_external_records()
-    if self.keymapper:
+    if self.keymapper and not keymapped:
       external_records = [{self.keymapper[key]:str(dct[key]) for key in dct if dct[key] != ''} for dct in external_records]
     #print(f"Table.refresh_table() inserting {len(external_records)} records")
-    if external_records:
-      self.table.delete_many({})
-      print(f"Table.refresh_table({self.tableid}) destroyed contents")
-      #print(f"Table.refresh_table({self.table.name}) refill records {external_records}")
-      self.table.insert_many(external_records)
-      print(f"Table.refresh_table({self.tableid}) refilled {len(external_records)} records")
-    else:
+    if not external_records:
       print(f"Table.refresh_table({self.tableid}) not refreshed")
+      return None
+    records = [{key:rec[key] for key in rec if key != '_id'} for rec in external_records]
+    occurrences = Counter()
+    row_ids = []
+    for rec in records:
+      fingerprint = Table.fingerprint(rec)
+      row_ids += [f"{fingerprint}-{occurrences[fingerprint]}"]
+      occurrences[fingerprint] += 1
+    old_row_ids = self.get_row_ids()
+    if old_row_ids is None:
+      # No (complete) row ids stored, compare with what is in the table
+      old_row_ids = [doc['_id'] for doc in self.table.find({}, {'_id':1})]
+    (new_ids, old_ids) = (set(row_ids), set(old_row_ids))
+    ops = [InsertOne(dict(rec, _id=row_id)) for (row_id, rec) in zip(row_ids, records)
+      if row_id not in old_ids]
+    stale_ids = [row_id for row_id in old_row_ids if row_id not in new_ids]
+    if stale_ids:
+      ops += [DeleteMany({'_id':{'$in':stale_ids}})]
+    if ops:
+      # Should the bulk write fail halfway, the row ids must not be trusted
+      Table.db.fingerprints.update_one({'_id':self.tableid}, {'$set':{'complete':False}})
+      self.table.bulk_write(ops, ordered=False)
+    if ops or row_ids != old_row_ids:
+      Table.db.fingerprints.replace_one({'_id':self.tableid},
+        {'_id':self.tableid, 'rows':row_ids, 'complete':True}, upsert=True)
+    changes = len(ops) - bool(stale_ids) + len(stale_ids)
+    print(f"Table.refresh_table({self.tableid}) {len(records)} records, {changes} changes")
+    return changes
+
+  # Returns the row ids of the table, in the order of the external
+  # records as last refreshed, or None if not known
+  def get_row_ids(self):
+    stored = Table.db.fingerprints.find_one({'_id':self.tableid})
+    if not stored or not stored.get('complete'):
+      return None
+    return stored['rows']
+
+  def fingerprint(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
-  def refresh(self):
+  # Refresh the table, and remember when, unless there was nothing to
+  # refresh it with
+  def refresh(self, external_records = None, keymapped = False):
     #print(f"Table.refresh({self.tableid})")
-    self.refresh_table()
+    if self.refresh_table(external_records, keymapped) is not None:
+      self.set_refreshed()
+
+  def set_refreshed(self):
     self.refreshed = datetime.now()
-    result = Table.db.refreshed.replace_one({'tableid':self.tableid}, {'refreshed':self.refreshed}, upsert=True)
+    result = Table.db.refreshed.replace_one({'tableid':self.tableid},
+      {'tableid':self.tableid, 'refreshed':self.refreshed, 'modified':self.modified}, upsert=True)
+
+  def needs_refresh(self):
+    return not self.refreshed or self.refreshed < datetime.now() - Table.max_age
 
   def get_table(self):
     #print(f"Table.get_table({self.tableid})")
-    if True or not self.refreshed or self.refreshed < datetime.now() - Table.max_age:
+    if self.needs_refresh():
       self.refresh()
     else:
       print(f"Table.get_table({self.tableid}) no refresh needed")
@@ -97,25 +174,97 @@ class GS_Table(Table):
   def get_external_records(self):
     return self.tab.read_all()
 
+# Thread safe token bucket, allowing rate calls per second on average,
+# and at most burst calls at once
+class Rate_Limiter:
+  def __init__(self, rate, burst = 1):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.stamp = time.monotonic()
+    self.lock = threading.Lock()
+
+  # Wait until a call may be made
+  def acquire(self):
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+      self.stamp = now
+      self.tokens -= 1
+      wait = -self.tokens / self.rate if self.tokens < 0 else 0
+    if wait:
+      time.sleep(wait)
+
+# Apply keymapper to the header row of a tab, once, and then make records
+# of the rows, with the mapped keys, leaving out empty cells. Like with
+# Table.refresh_table(), only keys that have values need to be mapped, so
+# columns with nothing in them are left out before mapping.
+def map_rows(values, keymapper = None):
+  if not values:
+    return []
+  (header, rows) = (values[0], values[1:])
+  used = {n for row in rows for (n, value) in enumerate(row) if value != ''}
+  columns = [(n, keymapper[key] if keymapper else key) for (n, key) in enumerate(header) if n in used]
+  return [{key:row[n] for (n, key) in columns if n < len(row) and row[n] != ''} for row in rows]
+
 class GS_Tab:
+  # Authorized clients, shared by all tabs, one per set of scopes
+  clients = {}
+  clients_lock = threading.Lock()
+  credentials_file = 'toughchassis_secret.json'
+  # Sheets API quota is 60 read requests per minute per user
+  rate_limiter = Rate_Limiter(rate=1.0, burst=10)
+
   def __init__(self, sheetid, tabid):
-    self.client = {}
     self.sheetid = sheetid
     self.tabid = tabid
 
-  def _get_client(self, scopes):
+  # Make a new authorized client, may be replaced e.g. with a
+  # coffer_fake_sheets.Fake_Sheets_Client for testing
+  def authorize(scopes):
+    creds = ServiceAccountCredentials.from_json_keyfile_name(GS_Tab.credentials_file, scopes)
+    return gspread.authorize(creds)
+
+  def get_client(scopes):
     #scope = ['https://www.googleapis.com/auth/spreadsheets.readonly']
     #scope = ['https://www.googleapis.com/auth/spreadsheets  ']
     scopekey = "+".join(scopes)
-    if(not scopekey in self.client):
-      creds = ServiceAccountCredentials.from_json_keyfile_name('toughchassis_secret.json', scopes)
-      self.client[scopekey] = gspread.authorize(creds)
-    return self.client[scopekey]
+    with GS_Tab.clients_lock:
+      if(not scopekey in GS_Tab.clients):
+        GS_Tab.clients[scopekey] = GS_Tab.authorize(scopes)
+      return GS_Tab.clients[scopekey]
 
   def read_all(self):
     scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly']
-    handle = self._get_client(scopes).open_by_key(self.sheetid).worksheet(self.tabid)
+    client = GS_Tab.get_client(scopes)
+    GS_Tab.rate_limiter.acquire()
+    sheet = client.open_by_key(self.sheetid)
+    GS_Tab.rate_limiter.acquire()
+    handle = sheet.worksheet(self.tabid)
+    GS_Tab.rate_limiter.acquire()
     all_recs = handle.get_all_records()
     #print(f"GS_Tab({self.sheetid},{self.tabid}) returning {len(all_recs)} records")
     return all_recs
 
+# A whole spreadsheet, whose tabs can be read in one request
+class GS_Sheet:
+  scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly',
+            'https://www.googleapis.com/auth/drive.metadata.readonly']
+
+  def __init__(self, sheetid):
+    self.sheetid = sheetid
+    self.client = GS_Tab.get_client(GS_Sheet.scopes)
+
+  # Returns the Drive modifiedTime of the spreadsheet
+  def read_modified(self):
+    GS_Tab.rate_limiter.acquire()
+    return self.client.get_file_drive_metadata(self.sheetid)['modifiedTime']
+
+  # Read the tabs in tabids with one values.batchGet request. Returns a
+  # dict with the keymapped records of each tab.
+  def read_tabs(self, tabids, keymapper = None):
+    ranges = ["'" + tabid.replace("'", "''") + "'" for tabid in tabids]
+    GS_Tab.rate_limiter.acquire()
+    reply = self.client.http_client.values_batch_get(self.sheetid, ranges)
+    return {tabid:map_rows(value_range.get('values', []), keymapper)
+      for (tabid, value_range) in zip(tabids, reply['valueRanges'])}
@@ -56,6 +56,8 @@ class CS_Task(Task):
     #{'Title': 'FFF Global Map WFF', 'Frequency': 'daily', 'Link': 'Open', 'Columns': 'ECOUNTRY, ECITY, ELOCATION, ETIME, EDATE, EFREQ, ELINK, ETYPE, GLAT, GLON, CNAME, CEMAIL, CPHONE, CNOTES, CORG2, CCOL', 'Trafis': 'isApproved, tISODate, tGoogleLoc, tisRecurringOn', 'Sumfis': 'sumGroupByCity, sumCountCountries, sumForkRecurringEvents', 'Params': 'date:2019-09-20+2019-09-21--2019-09-27', 'Delivery': 'toGoogle', 'Sheet': '1bFdJDjElWlNUOabE0p9lXM8OeGr4KyPxFF00zyHL5nE', 'Input': '', 'Global Sync': '', 'Map Organiser': '', 'Notify email': '', 'Comments': '', 'Actual Title': '', 'Sheet link view only': '', 'Social Media': '', 'Country Organising Minutes': '', 'Country bulk reporting systeme': ''}]
 
 class Tasklist(Table):
+  index_keys = [FFF_Controlsheet_Dataformat.title_key]
+
   def __init__(self, tableid):
     self.name = tableid
     super().__init__(tableid)
@@ -65,11 +67,16 @@ class Tasklist(Table):
     tasks = []
     search_dict = {}
     if selector and selector[0]:
-      search_dict[FFF_Controlsheet_Dataformat.title_key] = {"$regex": f".*{re.escape(selector[0])}.*"}
+      # Substring match, like the Title checks in collect and generate
+      search_dict[FFF_Controlsheet_Dataformat.title_key] = {"$regex": re.escape(selector[0])}
     print(f"Tasklist.get_tasks({self.name}, {selector}) search_dict = {search_dict}")
     table = self.get_table()
     #print(f"Tasklist.get_tasks all tasks = {list(table.find())}")
-    for task_dict in table.find(search_dict):
+    # Rows are stored by content, so run the tasks in the order of the
+    # external records, as refreshed
+    order = {row_id:n for (n, row_id) in enumerate(self.get_row_ids() or [])}
+    task_dicts = sorted(table.find(search_dict), key=lambda task_dict: order.get(task_dict['_id'], len(order)))
+    for task_dict in task_dicts:
       print(f"Tasklist.get_tasks found = {task_dict}")
       new_task = Task.factory(task_dict)
       if new_task:
@@ -16,10 +16,11 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys, os, getopt
+import sys, os, getopt, csv, time, concurrent.futures
 import requests, json, uuid
-from typeform import Typeform
+from tyffin_typeform import Typeform
 from tyffin_geo import Geo
+import tyffin_diff, tyffin_json
 
 # json global constants
 true = True
@@ -59,21 +60,29 @@ false = False
 class Formtree:
   master_typeform = 'yQuH5S' 
   public_typeform = 'DFFFuY' 
+  geo_records = None
   
   # Download TypeForm form and initialize processing structures
-  def __init__(self, form_id, filter1, filter2, fff_data_file = None):
+  #
+  # The TypeForm form catalogue and an unfiltered atlas with the FFF
+  # database already in it can be given, to be reused between forms.
+  # Geo is then set up from full_atlas instead, see Geo.load_view()
+  def __init__(self, form_id, filter1, filter2, fff_data_file = None, cache_dir = None,
+               incremental = False, stable_refs = False, forms = None, full_atlas = None):
     print(f"Reading TypeForm '{form_id}'")
-    self.forms = self.fetch_typeform_form_cat()
+    self.forms = forms or self.fetch_typeform_form_cat()
     self.tree = self.fetch_form_dict(form_id)
     if 'logic' not in self.tree:
       self.tree['logic'] = []
     self.refs = {}
+    self.stable_refs = stable_refs
     
-    # initialize Geo with the filters
-    Geo(filter1, filter2)
-    
+    # initialize Geo with the filters and the FFF database
+    if full_atlas:
+      Geo.load_view(filter1, filter2, full_atlas)
+      return
     print(f"Initializing from FFF database")
-    Geo.init_from_livedata(fff_data_file)
+    Geo.load(filter1, filter2, fff_data_file, cache_dir, incremental)
     print(f"Done initializing")
 
   # Fetch typeform form catalogue from the web
@@ -94,15 +103,39 @@ class Formtree:
     with open(source_filename, "rt", encoding="utf-8") as source_file:
       self.tree = json.loads(source_file.read())
 
-  # Generate a random UUID
-  def gen_uuid():
+  # Generate a random UUID, or, if an atlas path is given, a UUID derived
+  # from the path. Derived UUIDs are the same on every run, so regenerating
+  # an unchanged atlas gives an identical form.
+  ref_namespace = uuid.uuid5(uuid.NAMESPACE_URL, "https://github.com/janlindblad/tyffin")
+  def gen_uuid(geo_path = None):
+    if geo_path:
+      return str(uuid.uuid5(Formtree.ref_namespace, "/".join(geo_path)))
     return str(uuid.uuid4())
 
   # Generate all the TypeForm questions about locations, i.e.
   # country, state, city or venue. This function is the entrypoint
   # that will traverse all the locations in the Geo.atlas
-  def make_geo_qs(self):
-    self.refs['L1'] = self._make_geo_rec('Earth', Geo.atlas['Earth'], [])
+  #
+  # If deferred, the questions are not added to the tree, but generated
+  # while the form is written to file, see write(). With more than one
+  # job, the countries are generated in that many worker processes.
+  def make_geo_qs(self, deferred = False, jobs = 1):
+    root_path = ('Earth',)
+    self.refs['L1'] = self.geo_qid(root_path)
+    if jobs > 1:
+      records = self.iter_geo_records_parallel(self.refs['L1'], jobs)
+    else:
+      records = self.iter_geo_records(self.refs['L1'], root_path, Geo.atlas['Earth'])
+    if deferred:
+      self.geo_records = records
+      self.geo_logic_at = len(self.tree['logic'])
+      return
+    for (key, record) in records:
+      self.tree[key].append(record)
+
+  # Returns the ref for the question about the location at geo_path
+  def geo_qid(self, geo_path):
+    return Formtree.gen_uuid(geo_path if self.stable_refs else None)
 
   def get_title(geo_subcat, geo_path):
     if len(geo_path) < 2:
@@ -112,20 +145,72 @@ class Formtree:
     else:
         return f"[L2] Which {geo_subcat} in {geo_path[-1]} is the event in?"
 
-  # Generate a TypeForm question for a particular location.
-  # The location could be a country, state, city or venue
-  # The function will call itself recursively to generate
-  # questions for locations within the location, such as cities
-  # within a country.
-  def _make_geo_rec(self, geo_name, geo_info, geo_path):
-    (geo_subcat, geo_sub) = geo_info
-    new_path = geo_path + [geo_name]
-    this_qid = Formtree.gen_uuid()
-    label_other = '== Other =='
-
-    # Generate question
-    self.tree['fields'] += [{
-      "title": Formtree.get_title(geo_subcat, new_path),
+  # Generate the TypeForm questions for a location and all locations
+  # within it, such as the cities within a country. The location could
+  # be a country, state, city or venue.
+  #
+  # Yields ('fields', question) and ('logic', logic) records. The
+  # question about a location comes before the questions about the
+  # locations within it, and its logic after theirs, since the logic
+  # has to jump to them. The atlas is walked with an explicit stack
+  # of open locations, one entry per level, and nothing is kept of
+  # locations that are done.
+  def iter_geo_records(self, root_qid, root_path, root):
+    yield ('fields', Formtree.make_geo_field(root_qid, root[0], root[1], root_path))
+    # Stack entries: [qid, location, path, iterator over choices, logic jumps]
+    stack = [[root_qid, root, root_path, iter(root[1].items()), []]]
+    while stack:
+      (this_qid, geo_info, geo_path, choices, actions) = stack[-1]
+      for (geo_loc, sub_info) in choices:
+        # If this choice has no sub-locations, don't generate anything
+        # for this choice
+        if isinstance(sub_info, tuple):
+          break
+      else:
+        # All choices done, generate logic jumps
+        stack.pop()
+        yield ('logic', self.make_geo_logic(this_qid, geo_info[0], actions))
+        # Add a logic jump from the parent question, so that if this choice
+        # is selected, TypeForm will jump to the relevant sub-question
+        if stack:
+          stack[-1][4].append(Formtree.make_jump(stack[-1][0], this_qid, "equal", geo_path[-1]))
+        continue
+      # This location has sub-locations, generate them
+      sub_path = geo_path + (geo_loc,)
+      sub_qid = self.geo_qid(sub_path)
+      yield ('fields', Formtree.make_geo_field(sub_qid, sub_info[0], sub_info[1], sub_path))
+      stack.append([sub_qid, sub_info, sub_path, iter(sub_info[1].items()), []])
+
+  # Same as iter_geo_records() for the whole atlas, but the country
+  # subtrees are generated in parallel by a pool of worker processes.
+  # Only the question about the country, and the logic that jumps to
+  # the countries, are generated here. The results are taken in atlas
+  # order, so the output does not depend on the number of workers.
+  def iter_geo_records_parallel(self, root_qid, jobs):
+    (root, root_path) = (Geo.atlas['Earth'], ('Earth',))
+    yield ('fields', Formtree.make_geo_field(root_qid, root[0], root[1], root_path))
+    countries = [geo_loc for geo_loc in root[1] if isinstance(root[1][geo_loc], tuple)]
+    work = [(self.refs, self.stable_refs, root_path + (geo_loc,), root[1][geo_loc])
+            for geo_loc in countries]
+    actions = []
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+      results = executor.map(_make_geo_subtree, work, chunksize=max(1, len(work) // (4 * jobs)))
+      for (geo_loc, (country_qid, records)) in zip(countries, results):
+        yield from records
+        actions.append(Formtree.make_jump(root_qid, country_qid, "equal", geo_loc))
+    yield ('logic', self.make_geo_logic(root_qid, root[0], actions))
+
+  label_other = '== Other =='
+
+  # Returns true if the question for a location of this subcategory
+  # offers the "== Other ==" choice
+  def has_other(geo_subcat):
+    return geo_subcat not in [Geo.COUNTRY, Geo.STATE]
+
+  # Generate the question for a location
+  def make_geo_field(this_qid, geo_subcat, geo_sub, geo_path):
+    return {
+      "title": Formtree.get_title(geo_subcat, geo_path),
       "ref": this_qid,
       "properties": {
           "alphabetical_order": true,
@@ -138,105 +223,58 @@ class Formtree:
                   "label": Geo.get_label(geo_loc)
               } for geo_loc in geo_sub if geo_loc
           ] + ([{
-                  "label": label_other
-          }] if geo_subcat not in [Geo.COUNTRY, Geo.STATE] else [])
+                  "label": Formtree.label_other
+          }] if Formtree.has_other(geo_subcat) else [])
       },
       "validations": {
           "required": true
       },
       "type": "dropdown"
       #"type": "multiple_choice"
-    }]
+    }
 
-    # Generate logic jump
-    actions = []
-    for geo_loc in geo_sub:
-      # For each choice within this location, generate a sub-question
-      if not isinstance(geo_sub[geo_loc], tuple):
-        # If this choice has no sub-locations, don't generate anything
-        # for this choice
-        continue  
-      # This location has sub-locations, generate them
-      next_q = self._make_geo_rec(geo_loc, geo_sub[geo_loc], new_path)
-      # Add a logic jump from the parent question, so that if this choice
-      # is selected, TypeForm will jump to the relevant sub-question
-      if next_q:
-        actions += [{
-            "action": "jump",
-            "details": {
-                "to": {
-                    "type": "field",
-                    "value": next_q
-                }
-            },
-            "condition": {
-                "op": "equal",
-                "vars": [
-                    {
-                        "type": "field",
-                        "value": this_qid
-                    },
-                    {
-                        "type": "constant",
-                        "value": geo_loc
-                    }
-                ]
+  # Generate a logic jump action to the question to_qid. The op is
+  # "equal" or "contains" for jumps taken when the choice in question
+  # this_qid matches value, or "always" for unconditional jumps.
+  def make_jump(this_qid, to_qid, op, value = None):
+    return {
+        "action": "jump",
+        "details": {
+            "to": {
+                "type": "field",
+                "value": to_qid
             }
-        }]
-        
-    # Add a logic jump back to the question that
-    # goes after selection of "== Other =="
-    self.tree['logic'] += [{
-        "type": "field",
-        "ref": this_qid,
-        "actions": actions + [
-            {
-                "action": "jump",
-                "details": {
-                    "to": {
-                        "type": "field",
-                        "value": self.refs['NC']
-                    }
+        },
+        "condition": {
+            "op": op,
+            "vars": [
+                {
+                    "type": "field",
+                    "value": this_qid
                 },
-                "condition": {
-                    "op": "contains",
-                    "vars": [
-                       {
-                        "type":"field",
-                        "value":this_qid
-                     },
-                     {
-                        "type":"constant",
-                        "value":label_other
-                     }
-                    ]
+                {
+                    "type": "constant",
+                    "value": value
                 }
-            }
-        ]
-    }]
-    
-    # Finally, add a catch-all logic jump back to the question that
-    # goes after the country, state, city, venue questions
-    self.tree['logic'] += [{
+            ] if op != "always" else []
+        }
+    }
+
+  # Generate the logic for a location question: first the jumps to the
+  # sub-questions for the choices that have them, then a jump to the
+  # question that goes after selection of "== Other ==" (where that is
+  # offered), and finally a catch-all jump to the question that goes
+  # after the country, state, city, venue questions. TypeForm takes the
+  # first jump that matches.
+  def make_geo_logic(self, this_qid, geo_subcat, actions):
+    if Formtree.has_other(geo_subcat):
+      actions.append(Formtree.make_jump(this_qid, self.refs['NC'], "contains", Formtree.label_other))
+    actions.append(Formtree.make_jump(this_qid, self.refs['F1'], "always"))
+    return {
         "type": "field",
         "ref": this_qid,
-        "actions": actions + [
-            {
-                "action": "jump",
-                "details": {
-                    "to": {
-                        "type": "field",
-                        "value": self.refs['F1']
-                    }
-                },
-                "condition": {
-                    "op": "always",
-                    "vars": []
-                }
-            }
-        ]
-    }]
-    return this_qid
+        "actions": actions
+    }
 
   # Remove any question "id" attributes (that we read from TypeForm)
   # TypeForm likes to assign them, and does not tolerate them if 
@@ -253,25 +291,42 @@ class Formtree:
   # title. Location questions will have "[L.]" at the beginning of the
   # question (the dot stands for a number). Then remove all logic jumps 
   # that relate to the removed questions
+  #
+  # Both lists are rebuilt in a single pass each. Jump actions that lead
+  # to a removed question are dropped, and so are logic jumps that are
+  # left without actions.
+  geo_title_starts = ("[L", "Which city/", "Which state")
   def clean_geo_questions(self):
-    deleted_refs = {}
-    deleted_count = 0
-    for (n,q) in enumerate(list(self.tree['fields'])):
-      question_words = q['title'].split(" ")
-      if q['title'].startswith("[L") or q['title'].startswith("Which city/") or q['title'].startswith("Which state"):
+    fields = []
+    deleted_refs = set()
+    for q in self.tree['fields']:
+      if q['title'].startswith(Formtree.geo_title_starts):
         #print(f"Cleaning out '{q['title']}:{q}'")
-        deleted_refs[q['ref']] = None
-        del self.tree['fields'][n - deleted_count]
-        deleted_count += 1
-    print(f"Cleaned out {deleted_count} questions")
+        deleted_refs.add(q['ref'])
+      else:
+        fields += [q]
+    print(f"Cleaned out {len(self.tree['fields']) - len(fields)} questions")
+    self.tree['fields'] = fields
+
+    logic = []
     deleted_count = 0
-    for (n,j) in enumerate(list(self.tree['logic'])):
+    deleted_actions = 0
+    for j in self.tree['logic']:
       #{"actions": [ { "details": { "to": { "value": ]
-      if j['ref'] in deleted_refs or j.get('actions',[{}])[0].get('details',{}).get('to',{}).get('value') in deleted_refs:
-        #print(f"Cleaning out logic jump {j['ref']}")
-        del self.tree['logic'][n - deleted_count]
+      if j.get('ref') in deleted_refs:
         deleted_count += 1
-    print(f"Cleaned out {deleted_count} logic jumps")
+        continue
+      actions = [act for act in j.get('actions', [])
+        if act.get('details', {}).get('to', {}).get('value') not in deleted_refs]
+      if len(actions) < len(j.get('actions', [])):
+        if not actions:
+          deleted_count += 1
+          continue
+        deleted_actions += len(j['actions']) - len(actions)
+        j = dict(j, actions=actions)
+      logic += [j]
+    print(f"Cleaned out {deleted_count} logic jumps, and {deleted_actions} jump actions")
+    self.tree['logic'] = logic
 
   # Find the ref code for a question that starts with the given title
   def find_ref_for_title(self, title_start):
@@ -310,15 +365,32 @@ class Formtree:
   def scan_questions(self):
     for q in self.tree['fields']:
       #print(f"q = {q['title']}")
-      try:
-        q_code = q['title'].split(" ")[0]
-        if q_code[0] == "[" and q_code[-1] == "]":
-          self.refs[q_code[1:-1]] = q['ref']
-          #print(f"Ref[{q_code[1:-1]}] = {q['ref']}")
-      except:
-        pass
+      q_code = Formtree.question_code(q.get('title', ''))
+      if q_code:
+        self.refs[q_code] = q['ref']
+        #print(f"Ref[{q_code}] = {q['ref']}")
     #print(f"Refs = {self.refs}")
 
+  # Returns the code of a question, e.g. 'E1' for a question titled
+  # '[E1] ...', or None if the title has no code
+  def question_code(title):
+    q_code = title.split(" ")[0]
+    if len(q_code) > 2 and q_code[0] == "[" and q_code[-1] == "]":
+      return q_code[1:-1]
+    return None
+
+  # Returns the name of the column for the answers to a question in a
+  # table of responses: the question code, except that the L2 questions
+  # ask for either a city or a venue (see get_title()), and these get a
+  # column each, 'L2 city' and 'L2 venue'
+  def question_column(title):
+    q_code = Formtree.question_code(title)
+    if q_code == 'L2':
+      for subcat in [Geo.CITY, Geo.VENUE]:
+        if title.startswith(f"[L2] Which {subcat} in "):
+          return f"L2 {subcat.split('/')[0]}"
+    return q_code
+
   # TypeForm allows logic jumps, but only in the forward direction, 
   # i.e. a logic jump must never jump to an earlier question.
   # Therefore we have to sort questions to ensure they come in the
@@ -355,66 +427,103 @@ class Formtree:
     # The sections have to go in this order
     for c in ["C", "S", "E", "L", "N", "F"]:
       self.tree['fields'] += classified_qs[c]
+      if c == "L":
+        # Deferred location questions go last in the location section
+        self.geo_fields_at = len(self.tree['fields'])
+
+  # Form generation top level: replace the location questions in the
+  # form with new ones for the current atlas. See make_geo_qs() for
+  # deferred and jobs
+  def make_form(self, deferred = False, jobs = 1):
+    # Remove all country, state, city, venue related questions
+    self.clean_geo_questions()
+    # Remove all question id attributes
+    self.clean_ids()
+    # Store refs to questions
+    self.scan_questions()
+    # Make new country, state, city, venue questions
+    self.make_geo_qs(deferred, jobs)
+    # Update stored refs to questions
+    self.sort_questions()
+    # Add additional logic jumps
+    self.add_jump_out_logic()
 
   # TypeForm uses UUIDs to identify questions in the
   # logic jumps. This function validates that all logic
-  # jumps are referring to questions that actually exist
+  # jumps are referring to questions that actually exist,
+  # and that they only jump forward in the form.
+  #
+  # Returns a report with
+  #   'refs':           {ref: {'index', 'title', 'uses'}} for all questions
+  #                     and thankyou screens, in form order
+  #   'errors':         descriptions of broken logic jumps
+  #   'backward_jumps': {'from': ref, 'to': ref} for each jump that does
+  #                     not go forward
   def validate_refs(self):
-    fields = {}
-    for q in self.tree['fields'] + self.tree['thankyou_screens']:
-      fields[q['ref']] = 0
+    refs = {}
+    for (n, q) in enumerate(self.tree['fields'] + self.tree['thankyou_screens']):
+      refs[q['ref']] = {'index': n, 'title': q.get('title', ''), 'uses': 0}
+    errors = []
+    backward_jumps = []
     for j in self.tree['logic']:
       if 'ref' not in j:
-        print(f"### No ref in jump")
+        errors += [f"No ref in jump"]
         continue
-      if j['ref'] not in fields:
-        print(f"### Jump from unknown field {j['ref']}")
+      if j['ref'] not in refs:
+        errors += [f"Jump from unknown field {j['ref']}"]
         continue
-      fields[j['ref']] += 1
+      source = refs[j['ref']]
+      source['uses'] += 1
       if 'actions' not in j:
-        print(f"### No actions in jump: {j}")
+        errors += [f"No actions in jump: {j}"]
         continue
       for act in j['actions']:
-        if 'details' not in act:
-          print(f"### No details in jump: {j}")
+        to = act.get('details', {}).get('to', {})
+        if 'value' not in to:
+          errors += [f"No details/to/value in jump from {j['ref']}"]
           continue
-        if 'to' not in act['details']:
-          print(f"### No to in jump")
+        if to['value'] not in refs:
+          errors += [f"Jump to unknown field {to['value']}"]
           continue
-        if 'value' not in act['details']['to']:
-          print(f"### No value in jump")
-          continue
-        if act['details']['to']['value'] not in fields:
-          print(f"### Jump to unknown field {act['details']['to']['value']}")
-          continue
-        fields[act['details']['to']['value']] += 1
-        if 'condition' not in act:
-          print(f"### No condition in jump")
-          continue
-        if 'vars' not in act['condition']:
-          print(f"### No vars in jump")
+        refs[to['value']]['uses'] += 1
+        if refs[to['value']]['index'] <= source['index']:
+          backward_jumps += [{'from': j['ref'], 'to': to['value']}]
+        if 'vars' not in act.get('condition', {}):
+          errors += [f"No condition/vars in jump from {j['ref']}"]
           continue
         for var in act['condition']['vars']:
-          if 'type' not in var:
-            print(f"### No value in jump condition")
-            continue
-          if var['type'] != 'field':
+          if var.get('type') != 'field':
             continue
           if 'value' not in var:
-            print(f"### No value in jump condition")
+            errors += [f"No value in jump condition from {j['ref']}"]
             continue
-          if var['value'] not in fields:
-            print(f"### Jump reference to unknown field {var['value']}")
+          if var['value'] not in refs:
+            errors += [f"Jump reference to unknown field {var['value']}"]
             continue
-          fields[var['value']] += 1
-    # FIXME: check that refs go forward only
-    for f in fields:
-      print(f"{f} : {fields[f]} : {[q['title'][:40] for q in self.tree['fields'] if q['ref'] == f]}")
+          refs[var['value']]['uses'] += 1
+    return {'refs': refs, 'errors': errors, 'backward_jumps': backward_jumps}
+
+  # Print the problems found by validate_refs()
+  def print_validation(self, report):
+    refs = report['refs']
+    for error in report['errors']:
+      print(f"### {error}")
+    for jump in report['backward_jumps']:
+      print(f"### Backward jump from '{refs[jump['from']]['title'][:40]}' to '{refs[jump['to']]['title'][:40]}'")
+    print(f"Validated {len(refs)} questions: {len(report['errors'])} errors, "
+          f"{len(report['backward_jumps'])} backward jumps")
 
-  # Write form to a local file
-  def write(self, output_file):
+  # Write form to a local file. Without indent, the file is written
+  # as compact as possible. Deferred location questions, see make_geo_qs(),
+  # are generated and written one by one
+  def write(self, output_file, indent = 2):
     with open(output_file, "wt", encoding="utf-8") as out:
-      out.write(json.dumps(self.tree, indent=2))
+      if self.geo_records:
+        tyffin_json.write_json(out, self.tree, indent, self.geo_records,
+          {'fields': self.geo_fields_at, 'logic': self.geo_logic_at})
+        self.geo_records = None
+      else:
+        tyffin_json.write_json(out, self.tree, indent)
     print(f"Wrote TypeForm to file '{output_file}'")
 
   # Upload updated form to Typeform
@@ -430,27 +539,162 @@ class Formtree:
       print("Uploaded successfully")
     else:
       print(f"Upload failure: {str(response)[:500]}...")
+
+  # Compare the form with the current version of the form on TypeForm.
+  # Returns the current version and the list of changes, see tyffin_diff
+  def diff_typeform(self, form_id):
+    print(f"Comparing with TypeForm '{form_id}'")
+    current_tree = self.fetch_form_dict(form_id)
+    changes = tyffin_diff.diff_forms(current_tree, self.tree)
+    print(f"Changes: {tyffin_diff.summarize(changes) or 'none'}")
+    return (current_tree, changes)
+
+  # Upload only what has changed compared to the current version of the
+  # form. Changes to the top level form attributes alone are PATCHed.
+  # TypeForm does not PATCH fields or logic, so otherwise the form is PUT,
+  # with the ids of all unchanged questions kept, which keeps the replies
+  # given to those. Returns True if the form is up to date afterwards.
+  def upload_typeform_diff(self, form_id, current_tree, changes):
+    if not changes:
+      print(f"TypeForm '{form_id}' is up to date, nothing to upload")
+      return True
+    if tyffin_diff.is_patchable(changes):
+      print(f"Patching TypeForm '{form_id}'")
+      patch = [{"op": "replace", "path": op['path'], "value": op['value']} for op in changes]
+      response = self.forms.update(form_id, patch, patch=True)
+      if response == 'OK':
+        print("Patched successfully")
+        return True
+      print(f"Patch failure: {str(response)[:500]}...")
+      return False
+    print(f"Writing TypeForm '{form_id}'")
+    response = self.forms.update(form_id, tyffin_diff.merge_ids(current_tree, self.tree))
+    if(response['id'] == form_id):
+      print("Uploaded successfully")
+      return True
+    print(f"Upload failure: {str(response)[:500]}...")
+    return False
     
+# Worker process entry point for Formtree.iter_geo_records_parallel().
+# Generates the questions for one country, without downloading any form.
+# Returns the ref of the country question and the list of records.
+def _make_geo_subtree(work):
+  (refs, stable_refs, geo_path, geo_info) = work
+  formtree = Formtree.__new__(Formtree)
+  formtree.refs = refs
+  formtree.stable_refs = stable_refs
+  this_qid = formtree.geo_qid(geo_path)
+  return (this_qid, list(formtree.iter_geo_records(this_qid, geo_path, geo_info)))
+
+# Batch mode: generate a form for each job in the manifest, a .csv file
+# with the columns Input,Output,Filter1,Filter2. Output is a 6-character
+# form-id to upload to, or a file name ending in .json to write to.
+#
+# The FFF database is read once, into an unfiltered atlas, and the atlas
+# for each job is derived from that. The forms are generated one by one,
+# and the uploads go out concurrently while the next form is generated.
+# As there is nobody to ask, uploads that would remove questions, with
+# all answers given to them, are skipped unless forced.
+batch_uploads = 4
+
+def read_manifest(manifest_file):
+  with open(manifest_file, "rt", encoding="utf-8", newline='') as f:
+    jobs = list(csv.DictReader(f))
+  for job in jobs:
+    if len(job['Input']) != 6 or not (len(job['Output']) == 6 or job['Output'].endswith('.json')):
+      raise Exception(f"Invalid manifest line, need form-ids or .json file: {job}")
+  return jobs
+
+def run_batch(manifest_file, map_file, cache_dir, incremental, stable_refs, jobs, indent,
+              force = False):
+  batch_start = time.perf_counter()
+  manifest = read_manifest(manifest_file)
+  print(f"Initializing from FFF database")
+  Geo.load('', '', map_file, cache_dir, incremental)
+  full_atlas = Geo.atlas
+  print(f"Done initializing in {time.perf_counter() - batch_start:.2f} s")
+  forms = None
+  results = []
+  with concurrent.futures.ThreadPoolExecutor(batch_uploads) as executor:
+    for job in manifest:
+      start = time.perf_counter()
+      # Forms that are uploaded are compared with what is on TypeForm, so
+      # their location questions need the same refs on every run
+      upload = not job['Output'].endswith('.json')
+      tree = Formtree(job['Input'], job['Filter1'], job['Filter2'],
+                      stable_refs=stable_refs or upload, forms=forms, full_atlas=full_atlas)
+      forms = tree.forms
+      tree.make_form(jobs=jobs)
+      tree.print_validation(tree.validate_refs())
+      generate_time = time.perf_counter() - start
+      if not upload:
+        tree.write(job['Output'], indent)
+        output = (True, time.perf_counter() - start - generate_time)
+      else:
+        output = executor.submit(_upload_batch_form, tree, job['Output'], force)
+      results.append((job, generate_time, output))
+    results = [(job, generate_time, output if isinstance(output, tuple) else output.result())
+               for (job, generate_time, output) in results]
+  print(f"Batch of {len(manifest)} forms:")
+  for (job, generate_time, (ok, output_time)) in results:
+    print(f"  {job['Input']} -> {job['Output']:20} {job['Filter1'] or '*'}/{job['Filter2'] or '*'}: "
+          f"generated in {generate_time:.2f} s, "
+          f"{'written' if ok else '### NOT written'} in {output_time:.2f} s")
+  print(f"Batch done in {time.perf_counter() - batch_start:.2f} s")
+
+# Upload one form in batch mode. Returns (success, seconds taken)
+def _upload_batch_form(tree, output_form, force):
+  start = time.perf_counter()
+  (current_tree, changes) = tree.diff_typeform(output_form)
+  removed = [op for op in changes if op['op'] == 'remove' and op['path'].startswith('/fields/')]
+  if removed and not force:
+    print(f"### Not writing TypeForm '{output_form}', {len(removed)} questions would be removed")
+    return (False, time.perf_counter() - start)
+  return (tree.upload_typeform_diff(output_form, current_tree, changes),
+          time.perf_counter() - start)
+
 def usage():
   print(
-    f"""{sys.argv[0]} [-f] [-i input_form] [-o output_form]
+    f"""{sys.argv[0]} [-f] [-i input_form] [-o output_form] [-m map_file] [-c cache_dir] [-j jobs] [-b manifest]
         Update Typeform with location questions from the FFF dababase
         -h                Show this help
         -i <input-form>   Typeform 6-character form-id to read from
         -o <output-form>  Typeform 6-character form-id to write to
         -f <output-file>  Send output to file instead
+        -m <map-file>     Read the FFF map database from file instead of the web
+        -c <cache-dir>    Cache the FFF map database and the finished atlas here
+        --full            Replace the whole output form, deleting all its replies
+        --stable-refs     Derive location question refs from the atlas path (always
+                          done when uploading only the changes)
+        --incremental     Update the cached atlas with map changes only (needs -c)
+        --stream          Generate location questions while writing (needs -f, skips validation)
+        --compact         Write the output file without indentation
+        -j <jobs>         Generate the countries in this many worker processes
+        -b <manifest>     Generate all forms listed in this .csv file, see run_batch()
+        --force           In batch mode, also upload forms that lose questions
     """)
 
 def main():
   output_file = None
   output_form = Formtree.public_typeform
   input_form = Formtree.master_typeform
+  map_file = None
+  cache_dir = None
+  incremental = False
+  full_upload = False
+  stable_refs = False
+  stream = False
+  indent = 2
+  jobs = 1
+  manifest_file = None
+  force = False
     
   filter1 = '' # default is no filter at level 1, all countries will be included
   filter2 = '' # default is also no level filtering 
   try:
-    opts, args = getopt.getopt(sys.argv[1:],"hi:o:f:r:d:",
-      ["help", "input=", "output=", "region_filter=", "district_filter="])
+    opts, args = getopt.getopt(sys.argv[1:],"hi:o:f:r:d:m:c:j:b:",
+      ["help", "input=", "output=", "region_filter=", "district_filter=",
+       "map=", "cache=", "incremental", "full", "stable-refs", "stream", "compact", "jobs=", "batch=", "force"])
   except getopt.GetoptError:
     usage()
     sys.exit(2)
@@ -474,30 +718,68 @@ def main():
       filter1 = arg
     elif opt in ("-d","--district_filter"):
       filter2 = arg
+    elif opt in ("-m","--map"):
+      map_file = arg
+    elif opt in ("-c","--cache"):
+      cache_dir = arg
+    elif opt == "--incremental":
+      incremental = True
+    elif opt == "--full":
+      full_upload = True
+    elif opt == "--stable-refs":
+      stable_refs = True
+    elif opt == "--stream":
+      stream = True
+    elif opt == "--compact":
+      indent = None
+    elif opt in ("-j","--jobs"):
+      if not arg.isdigit() or int(arg) < 1:
+        print(f"### Number of jobs must be a positive integer: {arg}")
+        sys.exit(3)
+      jobs = int(arg)
+    elif opt in ("-b","--batch"):
+      manifest_file = arg
+    elif opt == "--force":
+      force = True
     
     print('filters: ', filter1, ' ', filter2)
+  if manifest_file:
+    run_batch(manifest_file, map_file, cache_dir, incremental, stable_refs, jobs,
+              indent, force)
+    return
   # Form generation top level:
-  # Download existing form from TypeForm servers
-  tree = Formtree(input_form, filter1, filter2)  
-  # Remove all country, state, city, venue related questions
-  tree.clean_geo_questions()
-  # Remove all question id attributes
-  tree.clean_ids()
-  # Store refs to questions
-  tree.scan_questions()
-  # Make new country, state, city, venue questions
-  tree.make_geo_qs()
-  # Update stored refs to questions
-  tree.sort_questions()
-  # Add additional logic jumps
-  tree.add_jump_out_logic()
-  # (optional) Validate all question references before uploading
-  tree.validate_refs()
+  # Download existing form from TypeForm servers. When only the changes
+  # are uploaded, the location question refs are derived from the atlas
+  # path, so that questions that are still there are not replaced
+  if not (output_file or full_upload):
+    stable_refs = True
+  tree = Formtree(input_form, filter1, filter2, map_file, cache_dir, incremental,
+                  stable_refs)
+  # Make new country, state, city, venue questions. When streaming to
+  # file, they are only generated as the file is written
+  stream = stream and bool(output_file)
+  tree.make_form(deferred=stream, jobs=jobs)
+  # Validate all question references before uploading
+  if not stream:
+    tree.print_validation(tree.validate_refs())
 
   if output_file:
     # File output; can be manually inspected and uploaded to TypeForm
     # by e.g. Postman PUT https://api.typeform.com/forms/DFFFuY
-    tree.write(output_file)
+    tree.write(output_file, indent)
+  elif not full_upload:
+    # Upload only the changes. Replies are only lost for questions that
+    # are removed from the output form
+    (current_tree, changes) = tree.diff_typeform(output_form)
+    removed = [op for op in changes if op['op'] == 'remove' and op['path'].startswith('/fields/')]
+    if removed:
+      print(f"{len(removed)} questions will be removed from the output form '{output_form}', with all answers given to them.")
+      sys.stdout.write("Are you sure you want to continue (yes/n)? ")
+      ans = input().lower()
+      if ans != 'yes':
+        print(f"Will exit tyffin.py now.")
+        exit()
+    tree.upload_typeform_diff(output_form, current_tree, changes)
   else:
     print(f"If you run tyffin.py, all answers that have been given to the output form '{output_form}' will be deleted.")
     sys.stdout.write("Are you sure you want to run tyffin.py and thus delete the replies (yes/n)? ")
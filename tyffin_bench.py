@@ -0,0 +1,932 @@
+#!/usr/bin/env python3.6
+#
+#   FridaysForFuture TypeForm Input Generator
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys, os, getopt, time, io, contextlib, tempfile, threading, concurrent.futures
+import gzip, hashlib, tracemalloc, copy, json, datetime, gc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from tyffin_geo import Geo
+from tyffin import Formtree
+from tyffin_typeform import Typeform
+from tyffin_mock import MockTypeform
+
+# Micro-benchmarks for the tyffin processing steps. Each benchmark runs
+# against the map database file given with -m (by default the shipped
+# fff-global-map.json) and prints its timings. Benchmarks that also check
+# results report failures with check(), and the run then exits with
+# status 1.
+
+failures = []
+
+# Print and record a failed check, unless condition holds
+def check(condition, message):
+  if not condition:
+    print(f"### {message}")
+    failures.append(message)
+  return condition
+
+# Returns the best time of repeat runs of func, and its result. Garbage
+# from earlier runs is collected first, and the collector is off while
+# timing, so that a collection does not land on a random run. With setup,
+# the arguments are made by setup() for every run, outside the timing.
+def timed(func, *args, repeat = 5, setup = None):
+  best = None
+  for _ in range(repeat):
+    run_args = setup() if setup else args
+    gc.collect()
+    gc.disable()
+    try:
+      start = time.perf_counter()
+      result = func(*run_args)
+      elapsed = time.perf_counter() - start
+    finally:
+      gc.enable()
+    best = elapsed if best is None or elapsed < best else best
+  return (best, result)
+
+# The name normalizer as it was before it was compiled and memoized,
+# kept here as the reference for the names benchmark
+def legacy_clean_zip(name_with_zip):
+  def is_clean_word(word):
+    tipp = "0123456789()"
+    for ch in word:
+      if ch in tipp:
+        return False
+    return True
+  name_words = name_with_zip.split(" ")
+  clean_name = []
+  for name_word in name_words:
+    if is_clean_word(name_word) and name_word not in ['Municipality', 'Prefecture', 'District']:
+      clean_name += [name_word]
+  return " ".join([w for w in clean_name if w != ''])
+
+def legacy_get_city_name(raw_city_name):
+  return legacy_clean_zip(raw_city_name.split(",")[-1])
+
+# Compare the location name normalizer with the legacy one, on all the
+# Town and Country names in the map database
+def bench_names(map_file):
+  raw_names = []
+  for live in Geo.iter_livedata(map_file):
+    raw_names += [live[key] for key in ['Town', 'Country'] if key in live]
+  print(f"names: {len(raw_names)} raw names, {len(set(raw_names))} distinct")
+
+  mismatches = [name for name in raw_names
+    if Geo.get_city_name(name) != legacy_get_city_name(name)]
+  if mismatches:
+    print(f"### names: {len(mismatches)} names differ, e.g. {mismatches[:5]}")
+
+  def run_legacy():
+    return [legacy_get_city_name(name) for name in raw_names]
+  def run_compiled():
+    Geo.get_city_name.cache_clear()
+    return [Geo.clean_zip(name.split(",")[-1]) for name in raw_names]
+  def run_memoized():
+    return [Geo.get_city_name(name) for name in raw_names]
+  (legacy_time, _) = timed(run_legacy)
+  (compiled_time, _) = timed(run_compiled)
+  Geo.get_city_name.cache_clear()
+  (cold_time, _) = timed(run_memoized, repeat=1)
+  (warm_time, _) = timed(run_memoized)
+  print(f"names: legacy    {legacy_time*1000:8.2f} ms")
+  print(f"names: compiled  {compiled_time*1000:8.2f} ms")
+  print(f"names: memo cold {cold_time*1000:8.2f} ms")
+  print(f"names: memo warm {warm_time*1000:8.2f} ms")
+  print(f"names: {Geo.get_city_name.cache_info()}")
+
+# Local stand-in for the web server publishing the map database. It
+# serves a file with ETag and Last-Modified headers, gzip transfer, and
+# answers conditional requests with 304 like GitHub Pages does
+class MapServer(ThreadingHTTPServer):
+  def __init__(self, map_file):
+    with open(map_file, "rb") as source_file:
+      self.body = source_file.read()
+    self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+    self.last_modified = "Mon, 06 Jan 2020 01:26:00 GMT"
+    self.downloads = 0
+    super().__init__(("127.0.0.1", 0), MapRequestHandler)
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+
+  def url(self, path = "/fff-global-map.json"):
+    return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+class MapRequestHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    server = self.server
+    if (self.headers.get('If-None-Match') == server.etag or
+        self.headers.get('If-Modified-Since') == server.last_modified):
+      self.send_response(304)
+      self.end_headers()
+      return
+    body = server.body
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json; charset=utf-8')
+    self.send_header('ETag', server.etag)
+    self.send_header('Last-Modified', server.last_modified)
+    if 'gzip' in self.headers.get('Accept-Encoding', ''):
+      body = gzip.compress(body)
+      self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+    server.downloads += 1
+
+  def log_message(self, *args):
+    pass
+
+# Load the atlas from the local stand-in map server: once with an empty
+# cache directory, then repeatedly with the cache in place
+def bench_fetch(map_file):
+  server = MapServer(map_file)
+  Geo.livedata_url = server.url()
+  with tempfile.TemporaryDirectory() as cache_dir:
+    def run_load():
+      with contextlib.redirect_stdout(io.StringIO()):
+        Geo.load('', '', None, cache_dir)
+    (cold_time, _) = timed(run_load, repeat=1)
+    cold_downloads = server.downloads
+    (warm_time, _) = timed(run_load)
+    print(f"fetch: cold {cold_time*1000:8.2f} ms, {cold_downloads} downloads, {len(server.body)} bytes")
+    print(f"fetch: warm {warm_time*1000:8.2f} ms, {server.downloads - cold_downloads} downloads")
+  server.shutdown()
+
+# The atlas built as before add_path, by subscripting from the top for
+# every level of every pin. Kept here as the reference for the atlas
+# benchmark. Unlike the old code, it makes a city that was Z into one
+# with venues, instead of failing on it.
+def legacy_atlas(atlas, paths):
+  for (live_country, live_state, live_city, live_venue) in paths:
+    if live_state:
+      if atlas['Earth'][1][live_country] == Geo.Z:
+        atlas['Earth'][1][live_country] = (Geo.STATE, {})
+      if live_state not in atlas['Earth'][1][live_country][1] or atlas['Earth'][1][live_country][1][live_state] == Geo.Z:
+        atlas['Earth'][1][live_country][1][live_state] = (Geo.CITY, {})
+      if live_venue:
+        if live_city not in atlas['Earth'][1][live_country][1][live_state][1] or \
+           atlas['Earth'][1][live_country][1][live_state][1][live_city] == Geo.Z:
+          atlas['Earth'][1][live_country][1][live_state][1][live_city] = (Geo.VENUE, {})
+        atlas['Earth'][1][live_country][1][live_state][1][live_city][1][live_venue] = Geo.Z
+      else:
+        atlas['Earth'][1][live_country][1][live_state][1][live_city] = Geo.Z
+    else:
+      if atlas['Earth'][1][live_country] == Geo.Z:
+        atlas['Earth'][1][live_country] = (Geo.CITY, {})
+      if live_venue:
+        if live_city not in atlas['Earth'][1][live_country][1] or atlas['Earth'][1][live_country][1][live_city] == Geo.Z:
+          atlas['Earth'][1][live_country][1][live_city] = (Geo.VENUE, {})
+        atlas['Earth'][1][live_country][1][live_city][1][live_venue] = Geo.Z
+      else:
+        atlas['Earth'][1][live_country][1][live_city] = Geo.Z
+  return atlas
+
+def legacy_get_named_loc(atlas, geo_path):
+  p = atlas["Earth"]
+  for pname in geo_path:
+    if not isinstance(p, tuple):
+      return None
+    p = p[1].get(pname)
+  return p
+
+# Build the whole world atlas, venues included, with add_path and the
+# old way, and compare the build time and the time to look up every
+# location in it
+def bench_atlas(map_file):
+  with contextlib.redirect_stdout(io.StringIO()):
+    Geo('', '')
+    base_atlas = Geo.define_atlas('', '')
+    pins = list(Geo.iter_livedata(map_file))
+    paths = [path for path in map(Geo.resolve_pin, pins) if path]
+  # get_city_name() keeps only the last part of a Town, so the map pins
+  # never have venues. Every tenth pin gets a made up venue after it,
+  # which turns its city from Z into a location with venues, until the
+  # next pin without a venue in that city turns it back.
+  paths = [venue_path for (n, path) in enumerate(paths)
+           for venue_path in ([path, path[:3] + (f"Venue {n}",)] if n % 10 == 0 else [path])]
+  def run_add_path(atlas):
+    Geo.set_atlas(atlas)
+    for path in paths:
+      Geo.add_path(path)
+    return atlas
+  (add_path_time, atlas) = timed(run_add_path, setup=lambda: (copy.deepcopy(base_atlas),))
+  (legacy_time, legacy) = timed(legacy_atlas, paths, setup=lambda: (copy.deepcopy(base_atlas), paths))
+  check(atlas == legacy and list(Geo.iter_pin_paths(atlas)) == list(Geo.iter_pin_paths(legacy)),
+        "atlas: add_path and the old build differ")
+  def location_paths(geo_info, path = ()):
+    yield path
+    for (name, sub) in geo_info[1].items():
+      if isinstance(sub, tuple):
+        yield from location_paths(sub, path + (name,))
+  lookups = [list(path) for path in location_paths(atlas['Earth'])] * 10
+  (lookup_time, _) = timed(lambda: [Geo.get_named_loc(path) for path in lookups])
+  (legacy_lookup, _) = timed(lambda: [legacy_get_named_loc(atlas, path) for path in lookups])
+  print(f"atlas: {len(paths)} pins, {sum(1 for path in paths if path[3])} with venues, "
+        f"{len(lookups) // 10} locations")
+  print(f"atlas: build  add_path {add_path_time*1000:8.2f} ms, legacy {legacy_time*1000:8.2f} ms")
+  print(f"atlas: {len(lookups)} lookups walk {lookup_time*1000:8.2f} ms, legacy {legacy_lookup*1000:8.2f} ms")
+
+# A synthetic form with num_qs location questions among as many other
+# questions. Each location question has a logic jump to the next
+# question, and each other question one to the next other question, so
+# that both versions of the clean remove the same logic jumps.
+def synthetic_form(num_qs):
+  fields = []
+  logic = []
+  for n in range(2 * num_qs):
+    title = f"[L{n}] Which city in Place {n} is the event in?" if n % 2 else f"[E{n}] Question {n}?"
+    fields += [{"ref": f"q{n}", "title": title, "type": "dropdown", "properties": {}}]
+    logic += [{"type": "field", "ref": f"q{n}", "actions": [
+      {"action": "jump", "details": {"to": {"type": "field", "value": f"q{n + 1 if n % 2 else n + 2}"}},
+       "condition": {"op": "always", "vars": []}}]}]
+  return {"fields": fields, "logic": logic, "thankyou_screens": []}
+
+# Formtree.clean_geo_questions as it was before it was made linear, kept
+# here as the reference for the clean benchmark
+def legacy_clean_geo_questions(tree):
+  deleted_refs = {}
+  deleted_count = 0
+  for (n,q) in enumerate(list(tree['fields'])):
+    if q['title'].startswith("[L") or q['title'].startswith("Which city/") or q['title'].startswith("Which state"):
+      deleted_refs[q['ref']] = None
+      del tree['fields'][n - deleted_count]
+      deleted_count += 1
+  deleted_count = 0
+  for (n,j) in enumerate(list(tree['logic'])):
+    if j['ref'] in deleted_refs or j.get('actions',[{}])[0].get('details',{}).get('to',{}).get('value') in deleted_refs:
+      del tree['logic'][n - deleted_count]
+      deleted_count += 1
+
+# Remove the location questions from a synthetic form with 20k location
+# questions, the legacy way and the single pass way
+def bench_clean(map_file, num_qs = 20000):
+  form = synthetic_form(num_qs)
+  def run_legacy(tree):
+    legacy_clean_geo_questions(tree)
+    return tree
+  def run_linear(tree):
+    formtree = object.__new__(Formtree)
+    formtree.tree = tree
+    with contextlib.redirect_stdout(io.StringIO()):
+      formtree.clean_geo_questions()
+    return formtree.tree
+  def setup():
+    return (copy.deepcopy(form),)
+  (legacy_time, legacy_tree) = timed(run_legacy, repeat=5, setup=setup)
+  (linear_time, linear_tree) = timed(run_linear, repeat=5, setup=setup)
+  same = "same" if legacy_tree == linear_tree else "### DIFFERENT"
+  print(f"clean: {len(form['fields'])} questions, {len(form['logic'])} logic jumps, results {same}")
+  print(f"clean: legacy {legacy_time*1000:8.2f} ms, "
+        f"{len(legacy_tree['fields'])} questions, {len(legacy_tree['logic'])} logic jumps left")
+  print(f"clean: linear {linear_time*1000:8.2f} ms, "
+        f"{len(linear_tree['fields'])} questions, {len(linear_tree['logic'])} logic jumps left")
+
+# Formtree._make_geo_rec as it was before the "Other" and catch-all
+# logic were merged, kept here as the reference for the generate benchmark
+def legacy_make_geo_rec(formtree, geo_name, geo_info, geo_path):
+  (geo_subcat, geo_sub) = geo_info
+  new_path = geo_path + [geo_name]
+  this_qid = Formtree.gen_uuid()
+  formtree.tree['fields'] += [Formtree.make_geo_field(this_qid, geo_subcat, geo_sub, new_path)]
+  actions = []
+  for geo_loc in geo_sub:
+    if not isinstance(geo_sub[geo_loc], tuple):
+      continue
+    next_q = legacy_make_geo_rec(formtree, geo_loc, geo_sub[geo_loc], new_path)
+    if next_q:
+      actions += [Formtree.make_jump(this_qid, next_q, "equal", geo_loc)]
+  formtree.tree['logic'] += [{"type": "field", "ref": this_qid, "actions": actions + [
+    Formtree.make_jump(this_qid, formtree.refs['NC'], "contains", Formtree.label_other)]}]
+  formtree.tree['logic'] += [{"type": "field", "ref": this_qid, "actions": actions + [
+    Formtree.make_jump(this_qid, formtree.refs['F1'], "always")]}]
+  return this_qid
+
+# A Formtree with no questions of its own, for generating location
+# questions into
+def empty_formtree():
+  formtree = object.__new__(Formtree)
+  formtree.tree = {"fields": [], "logic": [], "thankyou_screens": []}
+  formtree.refs = {'NC': "new-city", 'F1': "final"}
+  formtree.stable_refs = True
+  return formtree
+
+# Generate the location questions for the whole world atlas, the legacy
+# way and the current way, and compare generation time and output size
+def bench_generate(map_file):
+  with contextlib.redirect_stdout(io.StringIO()):
+    Geo('', '')
+    Geo.init_from_livedata(map_file)
+  def run_legacy():
+    formtree = empty_formtree()
+    legacy_make_geo_rec(formtree, 'Earth', Geo.atlas['Earth'], [])
+    return formtree.tree
+  def run_current():
+    formtree = empty_formtree()
+    formtree.make_geo_qs()
+    return formtree.tree
+  for (name, run) in [('legacy', run_legacy), ('current', run_current)]:
+    (gen_time, tree) = timed(run)
+    size = len(json.dumps(tree, indent=2))
+    print(f"generate: {name:8} {gen_time*1000:8.2f} ms, {len(tree['fields'])} questions, "
+          f"{len(tree['logic'])} logic entries, {size/1024:8.1f} kB")
+
+# Generating and writing the location questions, as one materialized
+# tree dumped in one go, or streamed to file while they are generated
+def bench_write(map_file):
+  with contextlib.redirect_stdout(io.StringIO()):
+    Geo('', '')
+    Geo.init_from_livedata(map_file)
+  output_file = os.path.join(tempfile.mkdtemp(), "form.json")
+  def run_legacy():
+    formtree = empty_formtree()
+    legacy_make_geo_rec(formtree, 'Earth', Geo.atlas['Earth'], [])
+    with open(output_file, "wt", encoding="utf-8") as out:
+      out.write(json.dumps(formtree.tree, indent=2))
+  def run_streamed(indent):
+    formtree = empty_formtree()
+    formtree.make_geo_qs(deferred=True)
+    formtree.geo_fields_at = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+      formtree.write(output_file, indent)
+  def peak(func, *args):
+    tracemalloc.start()
+    func(*args)
+    peak_size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak_size
+  for (name, run, args) in [('legacy', run_legacy, ()), ('streamed', run_streamed, (2,)),
+                            ('compact', run_streamed, (None,))]:
+    (write_time, _) = timed(run, *args, repeat=3)
+    peak_size = peak(run, *args)
+    print(f"write: {name:8} {write_time*1000:8.2f} ms, peak {peak_size/1024:8.1f} kB, "
+          f"file {os.path.getsize(output_file)/1024:8.1f} kB")
+  os.remove(output_file)
+  os.rmdir(os.path.dirname(output_file))
+
+# Parallel generation of the location questions with 1, 2, 4... worker
+# processes, up to the number of cores. The atlas is scaled up with
+# renamed copies of all countries, so that there is enough work to share
+def bench_parallel(map_file, copies = 8):
+  with contextlib.redirect_stdout(io.StringIO()):
+    Geo('', '')
+    Geo.init_from_livedata(map_file)
+  countries = Geo.atlas['Earth'][1]
+  Geo.set_atlas({'Earth': (Geo.COUNTRY, {f"{name} {n}" if n else name: geo_info
+                                         for n in range(copies) for (name, geo_info) in countries.items()})})
+  def run(jobs):
+    formtree = empty_formtree()
+    formtree.make_geo_qs(jobs=jobs)
+    return formtree.tree
+  jobs_list = [1]
+  while jobs_list[-1] * 2 <= max(2, os.cpu_count() or 1):
+    jobs_list.append(jobs_list[-1] * 2)
+  (base_time, base_tree) = (None, None)
+  for jobs in jobs_list:
+    (gen_time, tree) = timed(run, jobs, repeat=3)
+    if base_tree is None:
+      (base_time, base_tree) = (gen_time, tree)
+    same = "same" if tree == base_tree else "### DIFFERENT"
+    print(f"parallel: {jobs:2} jobs {gen_time*1000:8.2f} ms, speedup {base_time/gen_time:5.2f}, "
+          f"{len(tree['fields'])} questions, output {same}")
+
+# Filtered atlases for all regions, each built from the map database,
+# or derived from one unfiltered atlas as in batch mode
+def bench_views(map_file):
+  regions = sorted({row.split(',')[0] for row in open(Geo.geo_data_filename, encoding="latin-1")
+                    if row.split(',')[0] not in ('', 'Filter1')})
+  def run_load():
+    with contextlib.redirect_stdout(io.StringIO()):
+      for region in regions:
+        Geo.load(region, '', map_file)
+  def run_views():
+    with contextlib.redirect_stdout(io.StringIO()):
+      Geo.load('', '', map_file)
+    full_atlas = Geo.atlas
+    for region in regions:
+      Geo.load_view(region, '', full_atlas)
+  for (name, run) in [('load', run_load), ('views', run_views)]:
+    (views_time, _) = timed(run, repeat=3)
+    print(f"views: {name:8} {views_time*1000:8.2f} ms for {len(regions)} regions")
+
+# Geo.define_atlas() before the geo-reference index, for comparison
+def legacy_define_atlas(_filter1, _filter2):
+  f = open(Geo.geo_data_filename, "r", encoding="latin-1")
+  line = f.readline() 
+  countries = {}
+  for line in f:
+    words = [x.strip() for x in line.split(',')]
+    if len(_filter1) > 0 and words[0] != _filter1:
+      continue
+    if len(_filter2) > 0 and words[1] != _filter2:
+      continue
+    country = words[2]
+    if len(words[3])==0:
+      if country not in countries:
+        countries[sys.intern(country)] = Geo.Z                
+    else:
+      state = words[3]
+      if not country in countries:
+        states = {}
+      states[sys.intern(state)] = Geo.Z
+      countries[sys.intern(words[2])] = (Geo.STATE, states)
+  return {'Earth': (Geo.COUNTRY, countries)}
+
+# The countries of an atlas and their states, in atlas order, for
+# comparing atlases including their order
+def atlas_items(atlas):
+  return [(country, list(geo_info[1]) if geo_info else None) for (country, geo_info) in atlas['Earth'][1].items()]
+
+# What the old scan gives for several regions (or districts) at once:
+# their countries merged, in file order, with the states of each
+# country in the order of the regions
+def legacy_merged_atlas(filters1, filters2):
+  file_order = list(legacy_define_atlas('', '')['Earth'][1])
+  countries = {}
+  for filter1 in filters1:
+    for filter2 in filters2:
+      for (country, geo_info) in legacy_define_atlas(filter1, filter2)['Earth'][1].items():
+        states = countries.setdefault(country, [])
+        states += [state for state in (geo_info[1] if geo_info else []) if state not in states]
+  return [(country, countries[country] or None) for country in file_order if country in countries]
+
+# Base atlases from the geo-reference index, checked against the old
+# line by line scan for every Filter1/Filter2 combination in the .csv
+# file, and for combined regions against the old scans merged. Then the
+# same for a small .csv file with districts, countries in several
+# regions, and states apart from the rest of their country, which the
+# old scan mixed up with the country in between.
+def bench_georef(map_file):
+  rows = [row.split(',') for row in open(Geo.geo_data_filename, encoding="latin-1")][1:]
+  regions = sorted({row[0].strip() for row in rows} - {''})
+  districts = sorted({row[1].strip() for row in rows} - {''})
+  filters = [(filter1, filter2) for filter1 in [''] + regions + ['Nowhere']
+                                for filter2 in [''] + districts + ['Nowhere']]
+  for (filter1, filter2) in filters:
+    check(atlas_items(Geo.define_atlas(filter1, filter2)) == atlas_items(legacy_define_atlas(filter1, filter2)),
+          f"georef: '{filter1}'/'{filter2}' differs from the old scan")
+  combinations = [[region, other] for region in regions for other in regions if other != region] + [regions]
+  for combined in combinations:
+    check(atlas_items(Geo.define_atlas(",".join(combined), '')) == legacy_merged_atlas(combined, ['']),
+          f"georef: {combined} differs from the old scans merged")
+  print(f"georef: checked {len(filters)} filters and {len(combinations)} region combinations")
+
+  (legacy_time, _) = timed(lambda: [legacy_define_atlas(*f) for f in filters])
+  (georef_time, _) = timed(lambda: [Geo.define_atlas(*f) for f in filters])
+  print(f"georef: legacy   {legacy_time*1000:8.2f} ms, georef {georef_time*1000:8.2f} ms "
+        f"for {len(filters)} filters")
+
+  geo_data_filename = Geo.geo_data_filename
+  with tempfile.NamedTemporaryFile("wt", encoding="latin-1", suffix=".csv", delete=False) as f:
+    f.write("Filter1,Filter2,Country,State\n"
+            "R1,D1,A,a1\nR1,D1,B,\nR1,D2,C,c1\nR1,D1,A,a2\nR2,D3,A,a3\nR2,D3,E,\nR2,D1,F,\n")
+  expected = {
+    ('', ''): [('A', ['a1', 'a2', 'a3']), ('B', None), ('C', ['c1']), ('E', None), ('F', None)],
+    ('R1', ''): [('A', ['a1', 'a2']), ('B', None), ('C', ['c1'])],
+    ('', 'D1'): [('A', ['a1', 'a2']), ('B', None), ('F', None)],
+    ('R1', 'D2'): [('C', ['c1'])],
+    ('R2', 'D2'): [],
+    ('R2,R1', 'D3'): [('A', ['a3']), ('E', None)],
+    ('R1, R2', 'D1'): [('A', ['a1', 'a2']), ('B', None), ('F', None)],
+    ('R2', 'D1,D3'): [('A', ['a3']), ('E', None), ('F', None)],
+  }
+  try:
+    Geo.geo_data_filename = f.name
+    for ((filter1, filter2), countries) in expected.items():
+      with contextlib.redirect_stdout(io.StringIO()):
+        atlas = Geo.define_atlas(filter1, filter2)
+      check(atlas_items(atlas) == countries, f"georef: '{filter1}'/'{filter2}' gives {atlas_items(atlas)}")
+  finally:
+    Geo.geo_data_filename = geo_data_filename
+    os.remove(f.name)
+  print(f"georef: checked {len(expected)} filters on districts and scattered states")
+
+# Fetching forms from the local mock TypeForm server, one by one with
+# the typeform SDK, and concurrently with the tyffin_typeform client. Then
+# the same with a rate limited and unreliable server, where the SDK
+# fails and the client retries.
+def bench_typeform(map_file, num_forms = 12):
+  import typeform.client
+  uids = [f"form{n:02d}" for n in range(num_forms)]
+  forms = {uid: synthetic_form(50) for uid in uids}
+  for (latency, rate, fail_every) in [(0.05, None, 0), (0.05, 10, 4)]:
+    with MockTypeform(forms, latency=latency, rate=rate, fail_every=fail_every) as mock:
+      typeform.client.API_BASE_URL = mock.url
+      def run_sdk():
+        failures = 0
+        for uid in uids:
+          try:
+            typeform.Typeform("token").forms.get(uid)
+          except Exception:
+            failures += 1
+        return failures
+      (sdk_time, failures) = timed(run_sdk, repeat=1)
+      # The client is told the server's rate limit, like TypeForm's 2/s
+      client = Typeform("token", base_url=mock.url, rate=rate or 50, burst=4, backoff=0.2)
+      (client_time, fetched) = timed(client.forms.get_many, uids, repeat=1)
+      client.close()
+      print(f"typeform: latency {latency*1000:.0f} ms, rate {rate or '-'}/s, fail every {fail_every or '-'}: "
+            f"sdk {sdk_time*1000:8.2f} ms ({failures} failed), "
+            f"client {client_time*1000:8.2f} ms ({num_forms - len(fetched)} failed, "
+            f"{client.client.stats['retries']} retries)")
+
+# The tyffin_typeform client against unreliable, rate limited and
+# failing mock TypeForm servers: how often it retries, how the token
+# bucket spaces its requests, and which errors it raises
+def bench_retries(map_file, num_forms = 12):
+  uids = [f"form{n:02d}" for n in range(num_forms)]
+  forms = {uid: synthetic_form(5) for uid in uids}
+  def error_of(func, *args):
+    try:
+      func(*args)
+    except Exception as e:
+      return str(e)
+    return None
+
+  # Every other request fails, so every form but the first needs one retry
+  with MockTypeform(forms, fail_every=2) as mock:
+    client = Typeform("token", base_url=mock.url, rate=1000, burst=10, backoff=0.01)
+    fetched = [client.forms.get(uid) for uid in uids]
+    client.close()
+  stats = client.client.stats
+  check(fetched == [forms[uid] for uid in uids], "retries: fail every 2: wrong forms")
+  check((stats['retries'], stats['requests'], mock.stats['500']) == (num_forms - 1, 2 * num_forms - 1, num_forms - 1),
+        f"retries: fail every 2: {stats}, {mock.stats['500']} failures served")
+  print(f"retries: fail every 2: {stats['requests']} requests, {stats['retries']} retries")
+
+  # Every request fails, so the client gives up after its retries
+  with MockTypeform(forms, fail_every=1) as mock:
+    client = Typeform("token", base_url=mock.url, rate=1000, burst=10, retries=2, backoff=0.01)
+    error = error_of(client.forms.get, uids[0])
+    client.close()
+  check(error == f"TypeForm GET /forms/{uids[0]} failed after 3 attempts: 500", f"retries: fail always: {error}")
+  check((client.client.stats['retries'], mock.stats['500']) == (2, 3),
+        f"retries: fail always: {client.client.stats}, {mock.stats['500']} failures served")
+  print(f"retries: fail always: {error}")
+
+  # The server allows fewer requests than the client sends, and every
+  # 429 is retried until all forms are fetched
+  with MockTypeform(forms, rate=4) as mock:
+    client = Typeform("token", base_url=mock.url, rate=1000, burst=num_forms, backoff=0.2)
+    fetched = client.forms.get_many(uids)
+    client.close()
+  stats = client.client.stats
+  check(fetched == [forms[uid] for uid in uids], "retries: rate limited: wrong forms")
+  check(mock.stats['429'] > 0 and stats['retries'] == mock.stats['429'],
+        f"retries: rate limited: {stats}, {mock.stats['429']} 429s served")
+  print(f"retries: rate limited: {stats['requests']} requests, {stats['retries']} retries")
+
+  # The token bucket keeps the client within the server's limit: at most
+  # burst + rate requests in any second, here 4 + 5 < 10
+  with MockTypeform(forms, rate=10) as mock:
+    client = Typeform("token", base_url=mock.url, rate=5, burst=4)
+    (bucket_time, fetched) = timed(client.forms.get_many, uids, repeat=1)
+    client.close()
+  check(fetched == [forms[uid] for uid in uids], "retries: token bucket: wrong forms")
+  check(mock.stats['429'] == 0 and client.client.stats['retries'] == 0,
+        f"retries: token bucket: {mock.stats['429']} 429s served")
+  check(bucket_time >= (num_forms - 4) / 5 * 0.95, f"retries: token bucket: too fast, {bucket_time:.2f} s")
+  print(f"retries: token bucket: {num_forms} forms in {bucket_time*1000:8.2f} ms")
+
+  # Errors other than 429 and 5xx are not retried, and raise the
+  # description TypeForm gives, or the status
+  responses = {uids[0]: [{"token": f"token{n}", "landed_at": "2020-09-25T10:00:00Z"} for n in range(3)]}
+  with MockTypeform(forms, responses) as mock:
+    client = Typeform("token", base_url=mock.url, rate=1000, burst=10, backoff=0.01)
+    errors = [
+      error_of(client.forms.get, "nosuchform"),
+      error_of(client.responses.delete, uids[0], [f"token{n}" for n in range(MockTypeform.max_delete + 1)]),
+    ]
+    listed = client.responses.list(uids[0])
+    replies = [client.responses.delete(uids[0], ["token0"]),
+               client.forms.update(uids[0], [{'op': 'replace', 'path': '/title', 'value': "New"}], patch=True)]
+    client.close()
+  check(errors == ["Form not found", f"At most {MockTypeform.max_delete} tokens per request"],
+        f"retries: errors: {errors}")
+  check(listed['total_items'] == 3, f"retries: errors: listed {listed}")
+  check(replies == ['OK', 'OK'] and client.client.stats['retries'] == 0,
+        f"retries: errors: {replies}, {client.client.stats}")
+  check([item['token'] for item in mock.responses[uids[0]]] == ["token1", "token2"] and
+        mock.forms[uids[0]]['title'] == "New", "retries: errors: delete or update not applied")
+  print(f"retries: errors: {errors}")
+
+# Retrieving all responses to a form from the local mock TypeForm server,
+# the old way with a single request, and paginated, streamed to NDJSON
+def bench_export(map_file, num_responses = 50000):
+  import tyffout
+  responses = [{"token": f"token{n:08d}", "landed_at": "2020-09-25T10:00:00Z",
+                "submitted_at": "2020-09-25T10:05:00Z",
+                "answers": [{"type": "text", "text": f"Answer {n}", "field": {"ref": "q1"}}]}
+               for n in range(num_responses)]
+  with MockTypeform({"abcdef": {}}, {"abcdef": responses}) as mock, \
+       tempfile.TemporaryDirectory() as output_dir:
+    client = Typeform("token", base_url=mock.url, rate=1000, burst=10)
+    (legacy_time, legacy) = timed(client.responses.list, "abcdef", repeat=1)
+    print(f"export: legacy   {legacy_time*1000:8.2f} ms, {len(legacy['items'])} of "
+          f"{legacy['total_items']} responses")
+    output_file = os.path.join(output_dir, "responses.ndjson")
+    def run_export():
+      with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return client.run(tyffout.export_responses(client.client, "abcdef", None, output_file))
+    (export_time, count) = timed(run_export, repeat=1)
+    tracemalloc.start()
+    run_export()
+    peak_size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"export: paged    {export_time*1000:8.2f} ms, {count} of {num_responses} responses, "
+          f"peak {peak_size/1024:8.1f} kB, file {os.path.getsize(output_file)/1024:8.1f} kB")
+    client.close()
+
+# Incremental sync of the responses to a form from the local mock TypeForm
+# server: the first run fetches all responses, later runs only new ones
+def bench_sync(map_file, num_responses = 50000, num_new = 100):
+  import tyffout
+  def response(n):
+    stamp = f"2020-09-{1 + n // 5000:02d}T10:{n // 60 % 60:02d}:{n % 60:02d}Z"
+    return {"token": f"token{n:08d}", "landed_at": stamp, "submitted_at": stamp,
+            "answers": [{"type": "text", "text": f"Answer {n}", "field": {"ref": "q1"}}]}
+  responses = [response(n) for n in reversed(range(num_responses))]
+  with MockTypeform({"abcdef": {}}, {"abcdef": responses}) as mock, \
+       tempfile.TemporaryDirectory() as output_dir:
+    client = Typeform("token", base_url=mock.url, rate=1000, burst=10)
+    output_file = os.path.join(output_dir, "responses.ndjson")
+    def run_sync():
+      with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return tyffout.sync_responses(client, "abcdef", None, output_file)
+    for (name, new) in [('first', 0), ('new', num_new), ('none', 0)]:
+      mock.responses["abcdef"][:0] = [response(n) for n in reversed(range(num_responses, num_responses + new))]
+      num_responses += new
+      requests = mock.stats['GET']
+      (sync_time, added) = timed(run_sync, repeat=1)
+      print(f"sync: {name:8} {sync_time*1000:8.2f} ms, {added} responses added, "
+            f"{mock.stats['GET'] - requests} requests")
+    client.close()
+
+# Deleting responses on the local mock TypeForm server, with 50 ms latency:
+# all in one request as before, and in chunks, one or several at a time
+def bench_delete(map_file, num_responses = 20000):
+  import tyffout
+  tokens = [f"token{n:08d}" for n in range(num_responses)]
+  with MockTypeform({"abcdef": {}}, latency=0.05) as mock, \
+       tempfile.TemporaryDirectory() as output_dir:
+    client = Typeform("token", base_url=mock.url, rate=1000, burst=10, retries=0)
+    mock.responses["abcdef"] = [{"token": token} for token in tokens]
+    try:
+      client.responses.delete("abcdef", tokens)
+      result = "ok"
+    except Exception as error:
+      result = f"failed: {error}"
+    print(f"delete: single request {result}")
+    for concurrency in [1, 4]:
+      mock.responses["abcdef"] = [{"token": token} for token in tokens]
+      tyffout.delete_concurrency = concurrency
+      progress_file = os.path.join(output_dir, f"deleted{concurrency}")
+      with contextlib.redirect_stdout(io.StringIO()):
+        (delete_time, deleted) = timed(client.run, tyffout.delete_responses(client.client,
+          "abcdef", tokens, progress_file), repeat=1)
+      print(f"delete: {concurrency} at a time {delete_time*1000:8.2f} ms, {len(deleted)} deleted, "
+            f"{len(mock.responses['abcdef'])} left")
+    client.close()
+
+# Flattening responses into tables, and then getting the answers to one
+# question: from the NDJSON responses, and from the column file
+def bench_flatten(map_file, num_responses = 50000, num_qs = 10):
+  import tyffout, tyffin_columns
+  form = {"fields": [{"ref": f"q{n}", "title": f"[E{n}] Question {n}?"} for n in range(num_qs)]}
+  with tempfile.TemporaryDirectory() as output_dir:
+    output_file = os.path.join(output_dir, "responses.ndjson")
+    with open(output_file, "wt", encoding="utf-8") as out:
+      for n in range(num_responses):
+        answers = [{"field": {"ref": f"q{q}", "type": "short_text"}, "type": "text",
+                    "text": f"Answer {n} to {q}"} for q in range(num_qs)]
+        out.write(json.dumps({"token": f"token{n:08d}", "landed_at": "2020-09-25T10:00:00Z",
+                              "submitted_at": "2020-09-25T10:05:00Z", "answers": answers}) + "\n")
+    (flatten_time, rows) = timed(tyffout.flatten_responses, form, output_file, repeat=1)
+    sizes = ", ".join(f"{ext} {os.path.getsize(output_file + ext)/1024:8.1f} kB"
+                      for ext in ["", ".csv", ".tcol"])
+    print(f"flatten: {flatten_time*1000:8.2f} ms for {rows} responses, {sizes}")
+    def run_ndjson():
+      return [next((answer['text'] for answer in item['answers'] if answer['field']['ref'] == "q3"), None)
+              for item in tyffout.iter_responses(output_file)]
+    def run_columns():
+      return tyffin_columns.read_columns(output_file + ".tcol", ["E3"])["E3"]
+    (ndjson_time, ndjson_column) = timed(run_ndjson, repeat=3)
+    (columns_time, column) = timed(run_columns, repeat=3)
+    same = "same" if column == ndjson_column else "### DIFFERENT"
+    print(f"flatten: one column from ndjson {ndjson_time*1000:8.2f} ms, "
+          f"from tcol {columns_time*1000:8.2f} ms, {same}")
+
+# Refreshing a coffer table of spreadsheet rows in an in-memory mongomock
+# database after a few kinds of edits to the sheet: destroying and
+# refilling the whole table as before, and writing only the changed rows
+def bench_refresh(map_file, num_rows = 5000):
+  import mongomock
+  from coffer_table import Table
+  Table.client = mongomock.MongoClient()
+  Table.db = Table.client.coffer
+  rows = [{"Title": f"Row {n}", "Country": f"Country {n % 200}", "Count": str(n % 1000)} for n in range(num_rows)]
+  edits = [("1% changed", [dict(row, Count="changed") if n % 100 == 0 else row for (n, row) in enumerate(rows)]),
+           ("row added at top", [{"Title": "New row"}] + rows),
+           ("first row deleted", rows[1:]),
+           ("duplicate added", rows + [rows[0]])]
+  def run_legacy(records):
+    Table.db.legacy.delete_many({})
+    Table.db.legacy.insert_many([dict(record) for record in records])
+  def contents(collection):
+    return sorted(json.dumps({key:doc[key] for key in doc if key != '_id'}, sort_keys=True)
+                  for doc in collection.find({}))
+  for (name, edited) in edits:
+    Table.db.drop_collection("rows")
+    Table.db.fingerprints.delete_many({})
+    table = Table("rows")
+    with contextlib.redirect_stdout(io.StringIO()):
+      run_legacy(rows)
+      table.refresh_table(rows)
+      (legacy_time, _) = timed(run_legacy, edited, repeat=1)
+      (refresh_time, changes) = timed(table.refresh_table, edited, repeat=1)
+    expected = sorted(json.dumps(row, sort_keys=True) for row in edited)
+    same = "same" if contents(Table.db.legacy) == contents(table.table) == expected else "### DIFFERENT"
+    print(f"refresh: {name:18} refill {legacy_time*1000:8.2f} ms, "
+          f"changed rows only {refresh_time*1000:8.2f} ms, {changes} changes, {same}")
+
+# Reading all Coffin# tables of an in-memory mongomock database for a
+# generate task: into one list as before, and streamed from a Table_Source
+def bench_stream(map_file, num_tables = 10, num_rows = 5000):
+  import mongomock
+  from coffer_table import Table
+  from coffer_generate import Table_Source
+  Table.client = mongomock.MongoClient()
+  Table.db = Table.client.coffer
+  for t in range(num_tables):
+    Table.db[f"Coffin#{t}"].insert_many([{"ECOUNTRY": f"Country {n % 200}", "ECITY": f"City {n}",
+      "CNOTES": "Notes " * 20} for n in range(num_rows)])
+    Table.db.refreshed.insert_one({"tableid": f"Coffin#{t}", "refreshed": datetime.datetime.now()})
+  def run_legacy():
+    records = []
+    for table_id in Table.get_collection_names(name_starts_with="Coffin#"):
+      records += list(Table(table_id).get_table().find({}))
+    return sum(1 for record in records if record["ECOUNTRY"] == "Country 7")
+  def run_source(projection = None):
+    records = Table_Source(Table.get_collection_names(name_starts_with="Coffin#"), projection)
+    return sum(1 for record in records if record["ECOUNTRY"] == "Country 7")
+  for (name, func, args) in [("list", run_legacy, ()), ("source", run_source, ()),
+                             ("projected", run_source, ({"ECOUNTRY": 1},))]:
+    with contextlib.redirect_stdout(io.StringIO()):
+      (run_time, count) = timed(func, *args, repeat=1)
+      tracemalloc.start()
+      func(*args)
+      peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    print(f"stream: {name:10} {run_time*1000:8.2f} ms, peak {peak/1024/1024:7.1f} MB, {count} matches")
+
+# The coffer store: opening tables, which looks up when they were last
+# refreshed, and finding tasks by title. Runs against the mongod at
+# COFFER_MONGO_URL if set, else against an in-memory mongomock database.
+def bench_store(map_file, num_tables = 500, num_tasks = 2000):
+  from coffer_table import Table
+  from coffer_task import Tasklist
+  if os.environ.get("COFFER_MONGO_URL"):
+    Table.mongo_url = os.environ["COFFER_MONGO_URL"]
+    client = None
+  else:
+    import mongomock
+    client = mongomock.MongoClient()
+  with contextlib.redirect_stdout(io.StringIO()):
+    Table.db_connect("coffer_bench", client)
+    for name in Table.get_collection_names("bench#"):
+      Table.db.drop_collection(name)
+    Table.db.refreshed.delete_many({"tableid": {"$regex": "^bench#"}})
+    Table.db.refreshed.insert_many([{"tableid": f"bench#{t}", "refreshed": datetime.datetime.now()}
+                                    for t in range(num_tables)])
+    tasklist = Tasklist("bench#tasks")
+    tasklist.table.insert_many([{"Title": f"Task {n}", "Trafis": ""} for n in range(num_tasks)])
+    (open_time, _) = timed(lambda: [Table(f"bench#{t}") for t in range(num_tables)], repeat=1)
+    (find_time, tasks) = timed(tasklist.get_tasks, ["Task 1234"], repeat=3)
+  indexes = [", ".join(Table.db[name].index_information()) for name in ["refreshed", "bench#tasks"]]
+  print(f"store: open {num_tables} tables {open_time*1000:8.2f} ms, "
+        f"find task {find_time*1000:8.2f} ms, {len(tasks)} found")
+  print(f"store: indexes refreshed: {indexes[0]}; tasks: {indexes[1]}")
+
+# Collecting the input tabs listed on a control sheet from a fake Sheets
+# backend with 100 ms latency and a quota of 30 calls per second, into an
+# in-memory mongomock database: one tab at a time as before, tab by tab
+# with several workers, and a spreadsheet at a time in batches, which is
+# then run again with no changes, and with one spreadsheet changed
+def legacy_collect(task, workers):
+  from coffer_table import GS_Table
+  from coffer_dataformat import FFF_GS_Dataformat
+  tables = [GS_Table(f"Coffin#{subtask['Title']}#{subtask['Sheet']}#{subtask['Input']}",
+                     subtask['Sheet'], subtask['Input'], keymapper=FFF_GS_Dataformat.keymapper)
+            for subtask in task.tasklist.get_tasks([])]
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    for (table, records) in zip(tables, executor.map(lambda table: table.get_external_records(), tables)):
+      table.refresh(records)
+
+def bench_collect(map_file, num_tabs = 30, num_rows = 200):
+  import mongomock
+  from coffer_table import Table, GS_Tab, Rate_Limiter
+  from coffer_collect import GS_Collect_Task
+  from coffer_fake_sheets import Fake_Sheets_Client
+  sheets = {"control": {"Control": [{"Title": f"Input {n}", "Sheet": f"sheet{n % 5}", "Input": f"Form {n}",
+                                     "Frequency": "daily", "Trafis": ""} for n in range(num_tabs)]}}
+  for n in range(num_tabs):
+    sheets.setdefault(f"sheet{n % 5}", {})[f"Form {n}"] = [{"Country": f"Country {r}", "Town": f"Town {r}",
+      "Number of people": r, "Notes (optional)": "" if r % 2 else "Note"} for r in range(num_rows)]
+  with contextlib.redirect_stdout(io.StringIO()):
+    Table.db_connect("coffer_bench", mongomock.MongoClient())
+  GS_Tab.rate_limiter = Rate_Limiter(rate=20, burst=10)
+  (max_age, Table.max_age) = (Table.max_age, datetime.timedelta(0))
+  fake = Fake_Sheets_Client(sheets, latency=0.1, quota=30, quota_period=1.0)
+  GS_Tab.clients = {}
+  GS_Tab.authorize = lambda scopes: fake
+  task = GS_Collect_Task("collect-gs", "control", "Control")
+  def stored():
+    return {name: [{key:doc[key] for key in doc if key != '_id'} for doc in Table.db[name].find({}).sort('_id')]
+            for name in Table.get_collection_names("Coffin#")}
+  runs = [("1 worker", legacy_collect, (task, 1)), ("8 workers", legacy_collect, (task, 8)),
+          ("batched", task.run, ([],)), ("unchanged", task.run, ([],)), ("1 changed", task.run, ([],))]
+  results = []
+  for (name, func, args) in runs:
+    if name == "1 changed":
+      fake.touch("sheet3")
+    calls = sum(fake.stats.values()) - fake.stats['peak']
+    with contextlib.redirect_stdout(io.StringIO()):
+      (collect_time, _) = timed(func, *args, repeat=1)
+    results += [stored()]
+    same = "same" if results[-1] == results[0] else "### DIFFERENT"
+    print(f"collect: {name:10} {collect_time*1000:8.2f} ms, "
+          f"{sum(fake.stats.values()) - fake.stats['peak'] - calls} calls, "
+          f"{sum(len(records) for records in results[-1].values())} records, {same}, "
+          f"{fake.stats['rejected']} rejected")
+  Table.max_age = max_age
+
+benchmarks = {
+  'names': bench_names,
+  'fetch': bench_fetch,
+  'atlas': bench_atlas,
+  'clean': bench_clean,
+  'generate': bench_generate,
+  'write': bench_write,
+  'parallel': bench_parallel,
+  'views': bench_views,
+  'georef': bench_georef,
+  'typeform': bench_typeform,
+  'retries': bench_retries,
+  'export': bench_export,
+  'sync': bench_sync,
+  'delete': bench_delete,
+  'flatten': bench_flatten,
+  'refresh': bench_refresh,
+  'stream': bench_stream,
+  'store': bench_store,
+  'collect': bench_collect,
+}
+
+def usage():
+  print(
+    f"""{sys.argv[0]} [-m map_file] [-b benchmark]
+        Run tyffin micro-benchmarks
+        -h                Show this help
+        -m <map-file>     FFF map database file to use (default fff-global-map.json)
+        -b <benchmark>    Benchmark to run, one of: {", ".join(benchmarks)} (default all)
+    """)
+
+def main():
+  map_file = "fff-global-map.json"
+  selected = list(benchmarks)
+  try:
+    opts, args = getopt.getopt(sys.argv[1:],"hm:b:",
+      ["help", "map=", "benchmark="])
+  except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+  for opt, arg in opts:
+    if opt in ('-h', '--help'):
+      usage()
+      sys.exit()
+    elif opt in ("-m", "--map"):
+      map_file = arg
+    elif opt in ("-b", "--benchmark"):
+      if arg not in benchmarks:
+        print(f"### Unknown benchmark: {arg}")
+        sys.exit(3)
+      selected = [arg]
+  for name in selected:
+    benchmarks[name](map_file)
+  if failures:
+    print(f"### {len(failures)} checks failed")
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
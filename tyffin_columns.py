@@ -0,0 +1,102 @@
+#   FridaysForFuture TypeForm Input Generator
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json, struct, zlib
+
+# A simple column store, so that a table can be loaded one column at a
+# time without parsing the rest, and without any extra dependencies.
+#
+# The file starts with magic, followed by row groups. Each row group is
+# a 4 byte (little endian) header length, a JSON header
+#   {"rows": <number of rows>, "columns": [{"name": ..., "size": ...}, ...]}
+# and then, for each column in the header, size bytes holding the zlib
+# compressed JSON array of the values in the column. Row groups may have
+# different columns; a column missing from a row group is all null there.
+
+magic = b"TYFFCOL1"
+compress_level = 6
+
+class ColumnWriter:
+  def __init__(self, filename):
+    self.out = open(filename, "wb")
+    self.out.write(magic)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  # Write one row group, from a dict of column name to list of values.
+  # All lists must have the same length.
+  def write_group(self, columns):
+    blocks = [zlib.compress(json.dumps(values, separators=(',', ':')).encode("utf-8"),
+                            compress_level) for values in columns.values()]
+    rows = len(next(iter(columns.values()), []))
+    header = json.dumps({
+      "rows": rows,
+      "columns": [{"name": name, "size": len(block)} for (name, block) in zip(columns, blocks)],
+    }).encode("utf-8")
+    self.out.write(struct.pack("<I", len(header)) + header)
+    for block in blocks:
+      self.out.write(block)
+
+  def close(self):
+    self.out.close()
+
+# Returns the names of the columns in the file, in order of appearance
+def read_column_names(filename):
+  names = {}
+  for (header, _) in iter_groups(filename):
+    names.update(dict.fromkeys(column['name'] for column in header['columns']))
+  return list(names)
+
+# Returns {name: [values]} for the named columns (default all). Only the
+# blocks of those columns are read and decompressed.
+def read_columns(filename, names = None):
+  names = read_column_names(filename) if names is None else names
+  table = {name: [] for name in names}
+  for (header, read_block) in iter_groups(filename):
+    present = {}
+    for column in header['columns']:
+      if column['name'] in table:
+        present[column['name']] = json.loads(zlib.decompress(read_block(column)).decode("utf-8"))
+    for name in names:
+      table[name] += present[name] if name in present else [None] * header['rows']
+  return table
+
+# Yields (header, read_block) for each row group in the file, where
+# read_block(column) reads the block of one of the columns in the header
+def iter_groups(filename):
+  with open(filename, "rb") as source_file:
+    if source_file.read(len(magic)) != magic:
+      raise Exception(f"'{filename}' is not a column file")
+    while True:
+      length = source_file.read(4)
+      if not length:
+        return
+      (length,) = struct.unpack("<I", length)
+      header = json.loads(source_file.read(length).decode("utf-8"))
+      offsets = {}
+      offset = source_file.tell()
+      for column in header['columns']:
+        offsets[column['name']] = offset
+        offset += column['size']
+      def read_block(column):
+        source_file.seek(offsets[column['name']])
+        return source_file.read(column['size'])
+      yield (header, read_block)
+      source_file.seek(offset)
@@ -0,0 +1,127 @@
+#   FridaysForFuture TypeForm Input Generator
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Compare a regenerated TypeForm form with the form as it currently is on
+# the TypeForm servers, so that only forms that have actually changed are
+# uploaded, and questions that are still there keep their identity.
+#
+# Fields and logic jumps are matched by their ref. The difference is
+# described as a list of JSON-Patch style operations, where fields and
+# logic jumps are addressed by ref rather than by position, e.g.
+#   {"op": "replace", "path": "/fields/<ref>/properties/choices", "value": [...]}
+#   {"op": "add", "path": "/logic/<ref>", "value": [...]}
+#   {"op": "remove", "path": "/fields/<ref>"}
+#   {"op": "reorder", "path": "/fields", "value": [<ref>, ...]}
+
+# Top level form attributes that the TypeForm PATCH operation accepts
+patchable_keys = ['title', 'theme', 'workspace', 'settings']
+# Top level form attributes that are sent when the whole form is PUT
+form_keys = patchable_keys + ['welcome_screens', 'thankyou_screens', 'fields', 'logic']
+
+# TypeForm adds attributes of its own (ids, default values) to what it
+# stores. Returns old reduced to the shape of new, so that such additions
+# don't count as changes.
+def _project(old, new):
+  if isinstance(old, dict) and isinstance(new, dict):
+    return {key: _project(old[key], new[key]) for key in new if key in old}
+  if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+    return [_project(o, n) for (o, n) in zip(old, new)]
+  return old
+
+def _changed(old, new):
+  return _project(old, new) != new
+
+def _by_ref(items):
+  grouped = {}
+  for item in items:
+    grouped.setdefault(item.get('ref'), []).append(item)
+  return grouped
+
+# Returns the list of operations that turn the old form into the new one
+def diff_forms(old_tree, new_tree):
+  ops = []
+  for key in form_keys:
+    if key in ['fields', 'logic'] or key not in new_tree:
+      continue
+    if _changed(old_tree.get(key), new_tree[key]):
+      ops += [{"op": "replace", "path": f"/{key}", "value": new_tree[key]}]
+
+  old_fields = {q['ref']: q for q in old_tree.get('fields', [])}
+  new_fields = {q['ref']: q for q in new_tree['fields']}
+  for q in new_tree['fields']:
+    ref = q['ref']
+    if ref not in old_fields:
+      ops += [{"op": "add", "path": f"/fields/{ref}", "value": q}]
+      continue
+    old_q = old_fields[ref]
+    for key in q:
+      if key == 'properties' and isinstance(old_q.get(key), dict):
+        for prop in q[key]:
+          if _changed(old_q[key].get(prop), q[key][prop]):
+            ops += [{"op": "replace", "path": f"/fields/{ref}/{key}/{prop}", "value": q[key][prop]}]
+      elif key != 'id' and _changed(old_q.get(key), q[key]):
+        ops += [{"op": "replace", "path": f"/fields/{ref}/{key}", "value": q[key]}]
+  for ref in old_fields:
+    if ref not in new_fields:
+      ops += [{"op": "remove", "path": f"/fields/{ref}"}]
+  kept_refs = [q['ref'] for q in old_tree.get('fields', []) if q['ref'] in new_fields]
+  if kept_refs != [q['ref'] for q in new_tree['fields'] if q['ref'] in old_fields]:
+    ops += [{"op": "reorder", "path": "/fields", "value": list(new_fields)}]
+
+  old_logic = _by_ref(old_tree.get('logic', []))
+  new_logic = _by_ref(new_tree.get('logic', []))
+  for ref in new_logic:
+    if ref not in old_logic:
+      ops += [{"op": "add", "path": f"/logic/{ref}", "value": new_logic[ref]}]
+    elif _changed(old_logic[ref], new_logic[ref]):
+      ops += [{"op": "replace", "path": f"/logic/{ref}", "value": new_logic[ref]}]
+  for ref in old_logic:
+    if ref not in new_logic:
+      ops += [{"op": "remove", "path": f"/logic/{ref}"}]
+  return ops
+
+# True if all the operations can be sent with the TypeForm PATCH operation
+def is_patchable(ops):
+  return all(op['path'][1:] in patchable_keys for op in ops)
+
+# Returns the new form, as it should be PUT to replace the old one. Fields
+# and choices that were already in the old form keep their ids, so that
+# TypeForm keeps them (and the replies given to them) rather than
+# replacing them with new ones.
+def merge_ids(old_tree, new_tree):
+  old_fields = {q['ref']: q for q in old_tree.get('fields', [])}
+  merged_tree = {key: new_tree[key] for key in form_keys if key in new_tree}
+  merged_tree['fields'] = []
+  for q in new_tree['fields']:
+    old_q = old_fields.get(q['ref'])
+    if old_q and 'id' in old_q:
+      q = dict(q, id=old_q['id'])
+      old_choices = {c.get('label'): c for c in old_q.get('properties', {}).get('choices', [])}
+      if 'choices' in q.get('properties', {}):
+        choices = [dict(c, **{key: old_choices[c['label']][key]
+          for key in ['id', 'ref'] if key in old_choices.get(c['label'], {})})
+          for c in q['properties']['choices']]
+        q['properties'] = dict(q['properties'], choices=choices)
+    merged_tree['fields'] += [q]
+  return merged_tree
+
+# Summarize operations as counts per kind, e.g. "add fields: 3"
+def summarize(ops):
+  counts = {}
+  for op in ops:
+    kind = f"{op['op']} {op['path'].split('/')[1]}"
+    counts[kind] = counts.get(kind, 0) + 1
+  return ", ".join(f"{kind}: {counts[kind]}" for kind in sorted(counts))
@@ -0,0 +1,89 @@
+#   FridaysForFuture TypeForm Input Generator
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os, json, codecs
+import requests
+from tyffin_json import chunk_size
+
+# A CachedDownload keeps a local copy of a web resource, together with
+# the ETag and Last-Modified headers it was served with. Requests for the
+# resource are made conditional on those, so that the body is only
+# transferred again when it has changed on the server.
+
+class CachedDownload:
+  def __init__(self, url, cache_dir):
+    self.url = url
+    self.filename = os.path.join(cache_dir, os.path.basename(url.rstrip("/")) or "download")
+    self.meta_filename = self.filename + ".meta"
+    self.reply = None
+    os.makedirs(cache_dir, exist_ok=True)
+
+  # Returns the headers stored with the cached copy, or an empty dict
+  # if there is no (usable) cached copy
+  def load_meta(self):
+    if not os.path.exists(self.filename):
+      return {}
+    try:
+      with open(self.meta_filename, "rt", encoding="utf-8") as meta_file:
+        meta = json.loads(meta_file.read())
+    except (OSError, ValueError):
+      return {}
+    return meta if meta.get('url') == self.url else {}
+
+  # Send a conditional request for the resource. Returns True if the
+  # cached copy is still current, in which case it can be read from
+  # self.filename. Otherwise the new body is waiting to be read with
+  # iter_text().
+  def request(self):
+    meta = self.load_meta()
+    headers = {'Accept-Encoding': 'gzip'}
+    if 'etag' in meta:
+      headers['If-None-Match'] = meta['etag']
+    if 'last_modified' in meta:
+      headers['If-Modified-Since'] = meta['last_modified']
+    self.reply = requests.get(self.url, headers=headers, stream=True)
+    if self.reply.status_code == 304 and meta:
+      self.reply.close()
+      print(f"Cached copy of '{self.url}' is up to date")
+      return True
+    if self.reply.status_code != 200:
+      self.reply.close()
+      raise Exception(f"Could not download '{self.url}': {self.reply.status_code}")
+    return False
+
+  # Yield the (unzipped, decoded) body of the reply as text, while
+  # writing it to the cache. The cached copy and its headers are only
+  # replaced once the whole body has been read.
+  def iter_text(self, encoding = "utf-8"):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    with self.reply, open(self.filename + ".tmp", "wb") as cache_file:
+      for block in self.reply.iter_content(chunk_size):
+        cache_file.write(block)
+        text = decoder.decode(block)
+        if text:
+          yield text
+      text = decoder.decode(b'', final=True)
+    os.replace(self.filename + ".tmp", self.filename)
+    meta = {'url': self.url}
+    if 'ETag' in self.reply.headers:
+      meta['etag'] = self.reply.headers['ETag']
+    if 'Last-Modified' in self.reply.headers:
+      meta['last_modified'] = self.reply.headers['Last-Modified']
+    with open(self.meta_filename, "wt", encoding="utf-8") as meta_file:
+      meta_file.write(json.dumps(meta))
+    print(f"Downloaded '{self.url}'")
+    if text:
+      yield text
@@ -14,8 +14,12 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys, os
-import requests, json
+import sys, os, re, csv
+import requests, hashlib, pickle, mmap
+from functools import lru_cache
+from collections import Counter
+from tyffin_json import iter_array_items, read_chunks, chunk_size
+from tyffin_fetch import CachedDownload
 
 # The Geo class handles the atlas data structure, which lists all
 # countries, states, cities, and venues known to FFF.
@@ -29,6 +33,11 @@ class Geo:
   CITY = "city/county"
   VENUE = "venue"
   Z = None
+
+  # Where the map database is published
+  livedata_url = "https://allforeco.github.io/fridaysforfuture/fff-global-map.json"
+  # The countries and states known to FFF, see define_atlas()
+  geo_data_filename = "filtered_geo_data.csv"
   
   # The atlas can be filtered in two levels, filter1 and filter2, corresponding to the levels
   #   Region    - which could include one or many countries, for example a whole contintent, and
@@ -40,9 +49,231 @@ class Geo:
   def __init__(self, _filter1, _filter2):
     
     Geo.canonical_names = Geo.define_canonical_names()
-    Geo.atlas = Geo.define_atlas(_filter1, _filter2)
+    Geo.set_atlas(Geo.define_atlas(_filter1, _filter2))
     
     return
+
+  # Make the given atlas the current one
+  def set_atlas(atlas):
+    Geo.atlas = atlas
+
+  # Set up Geo with a complete atlas, i.e. with the filters applied and
+  # the map database added. If a cache directory is given, the finished
+  # atlas is cached there, and loaded from the cache as long as neither
+  # the filters nor the contents of the input files have changed. The
+  # map database is then also kept in the cache directory, and only
+  # downloaded again when it has changed on the server.
+  #
+  # In incremental mode, only the pins of a changed map database that
+  # were not in the previous run are resolved to atlas paths, see
+  # apply_livedata_delta().
+  def load(_filter1, _filter2, geo_filename = None, cache_dir = None, incremental = False):
+    if not cache_dir:
+      Geo(_filter1, _filter2)
+      Geo.init_from_livedata(geo_filename)
+      return
+    live_chunks = None
+    if not geo_filename:
+      download = CachedDownload(Geo.livedata_url, cache_dir)
+      if not download.request():
+        live_chunks = download.iter_text()
+      geo_filename = download.filename
+    if not live_chunks:
+      snapshot_key = Geo.snapshot_key(_filter1, _filter2, geo_filename)
+      atlas = Geo.load_snapshot(cache_dir, _filter1, _filter2, snapshot_key)
+      if atlas:
+        Geo.canonical_names = Geo.define_canonical_names()
+        Geo.set_atlas(atlas)
+        print(f"Loaded atlas snapshot from '{cache_dir}'")
+        return
+    if live_chunks:
+      # The new map database is parsed as it is downloaded
+      pins = iter_array_items(live_chunks, 'data')
+    else:
+      pins = Geo.iter_livedata(geo_filename)
+    delta_state = None
+    if incremental:
+      delta_state = Geo.load_delta_state(cache_dir, _filter1, _filter2)
+    if delta_state:
+      Geo.canonical_names = Geo.define_canonical_names()
+      Geo.apply_livedata_delta(pins, delta_state, Geo.define_atlas(_filter1, _filter2))
+    else:
+      Geo(_filter1, _filter2)
+      if incremental:
+        delta_state = Geo.init_delta_state(pins)
+      else:
+        for live in pins:
+          Geo.add_pin(live)
+    if delta_state:
+      Geo.save_delta_state(cache_dir, _filter1, _filter2, delta_state)
+    snapshot_key = Geo.snapshot_key(_filter1, _filter2, geo_filename)
+    Geo.save_snapshot(cache_dir, _filter1, _filter2, snapshot_key)
+
+  # Set up Geo with the atlas for the filters, derived from an unfiltered
+  # atlas that already has the map database in it, so that many filtered
+  # atlases can be made without going through the map database again.
+  # The cities and venues of the countries that pass the filters are
+  # added to the base atlas in the same order as they were added to the
+  # unfiltered atlas, so the result is the same as from Geo.load().
+  def load_view(_filter1, _filter2, full_atlas):
+    Geo(_filter1, _filter2)
+    countries = Geo.atlas['Earth'][1]
+    for path in Geo.iter_pin_paths(full_atlas):
+      if path[0] in countries:
+        Geo.add_path(path)
+
+  # Returns the atlas paths (country, state, city, venue) of all cities
+  # and venues in the atlas, in atlas order. State and venue are None
+  # where there is none. Below a country with states, locations with
+  # cities are states, and locations with venues and Z are cities. A Z may
+  # also be a state without cities, but adding that as a city is a no-op.
+  def iter_pin_paths(atlas):
+    for (country, country_info) in atlas['Earth'][1].items():
+      if not isinstance(country_info, tuple):
+        continue
+      for (name, info) in country_info[1].items():
+        if isinstance(info, tuple) and info[0] == Geo.CITY:
+          for (city, city_info) in info[1].items():
+            yield from Geo.iter_city_paths(country, name, city, city_info)
+        else:
+          yield from Geo.iter_city_paths(country, None, name, info)
+
+  def iter_city_paths(country, state, city, city_info):
+    if isinstance(city_info, tuple):
+      for venue in city_info[1]:
+        yield (country, state, city, venue)
+    else:
+      yield (country, state, city, None)
+
+  # Incremental updates
+  #
+  # The delta state, kept in the cache directory between runs, holds the
+  # fingerprints of the map pins seen in the previous run, i.e. how many
+  # pins there were with each (Country, Town), and the atlas path each
+  # fingerprint resolved to. Only the pins that were added since then
+  # need to be resolved. The atlas is then made by adding the paths of
+  # all pins to the base atlas, in map order, so that it comes out the
+  # same as from a full build, down to the order of the names.
+  def pin_fingerprint(live):
+    return (live['Country'], live['Town']) if 'Town' in live else None
+
+  # Add all pins to a fresh atlas, and return the delta state for them
+  def init_delta_state(pins):
+    return Geo.add_pin_paths(pins, {})
+
+  # Add all pins to the current atlas, resolving only the fingerprints
+  # that have no path in known_paths yet. Returns the new delta state.
+  def add_pin_paths(pins, known_paths):
+    pin_counts = Counter()
+    pin_paths = {}
+    for live in pins:
+      fingerprint = Geo.pin_fingerprint(live)
+      if not fingerprint:
+        continue
+      pin_counts[fingerprint] += 1
+      if fingerprint not in pin_paths:
+        pin_paths[fingerprint] = known_paths[fingerprint] if fingerprint in known_paths else Geo.resolve_pin(live)
+      if pin_paths[fingerprint]:
+        Geo.add_path(pin_paths[fingerprint])
+    return {'pins': pin_counts, 'paths': pin_paths}
+
+  # Bring the atlas from the previous run up to date with the new pins,
+  # starting over from the base atlas. Prints a summary of the cities
+  # and venues added and removed per country.
+  def apply_livedata_delta(pins, delta_state, base_atlas):
+    Geo.set_atlas(base_atlas)
+    new_state = Geo.add_pin_paths(pins, delta_state['paths'])
+    added_pins = new_state['pins'] - delta_state['pins']
+    removed_pins = delta_state['pins'] - new_state['pins']
+    old_paths = set(filter(None, delta_state['paths'].values()))
+    new_paths = set(filter(None, new_state['paths'].values()))
+    summary = {}
+    for path in old_paths - new_paths:
+      summary.setdefault(path[0], [0, 0])[1] += 1
+    for path in new_paths - old_paths:
+      summary.setdefault(path[0], [0, 0])[0] += 1
+    delta_state.update(new_state)
+    print(f"Applied {sum(added_pins.values())} new and {sum(removed_pins.values())} removed map pins")
+    for country in sorted(summary):
+      (added, removed) = summary[country]
+      print(f"  {country}: +{added} -{removed}")
+    return summary
+
+  # There is one delta state per filter combination. It is only valid as
+  # long as the filters and the base atlas stay the same.
+  def delta_state_filename(cache_dir, _filter1, _filter2):
+    return Geo.snapshot_filename(cache_dir, _filter1, _filter2)[:-len(".snapshot")] + ".delta"
+
+  def load_delta_state(cache_dir, _filter1, _filter2):
+    filename = Geo.delta_state_filename(cache_dir, _filter1, _filter2)
+    try:
+      with open(filename, "rb") as state_file:
+        delta_state = pickle.load(state_file)
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError, pickle.UnpicklingError) as e:
+      print(f"### Could not load delta state '{filename}': {e}")
+      return None
+    if delta_state.get('key') != Geo.snapshot_key(_filter1, _filter2):
+      return None
+    return delta_state
+
+  def save_delta_state(cache_dir, _filter1, _filter2, delta_state):
+    filename = Geo.delta_state_filename(cache_dir, _filter1, _filter2)
+    delta_state['key'] = Geo.snapshot_key(_filter1, _filter2)
+    with open(filename + ".tmp", "wb") as state_file:
+      pickle.dump(delta_state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + ".tmp", filename)
+
+  # Atlas snapshot files start with a magic string and the key they were
+  # made for, followed by the pickled atlas. Bump the version whenever
+  # the atlas format or the way it is built changes.
+  snapshot_magic = b"TYFFATL1"
+  snapshot_version = 4
+
+  # The snapshot key is a hash over the filters and the contents of both
+  # input files, so that any change to them invalidates the snapshot.
+  # Without a map database file, the key covers the base atlas only.
+  def snapshot_key(_filter1, _filter2, geo_filename = None):
+    digest = hashlib.sha256()
+    digest.update(f"{Geo.snapshot_version}\0{_filter1}\0{_filter2}\0".encode("utf-8"))
+    for filename in filter(None, [Geo.geo_data_filename, geo_filename]):
+      with open(filename, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1024 * 1024), b''):
+          digest.update(block)
+      digest.update(b'\0')
+    return digest.digest()
+
+  # There is one snapshot file per filter combination. It is overwritten
+  # whenever the inputs change.
+  def snapshot_filename(cache_dir, _filter1, _filter2):
+    filter_hash = hashlib.sha1(f"{_filter1}\0{_filter2}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"atlas-{filter_hash[:12]}.snapshot")
+
+  # Returns the atlas stored in the snapshot, or None if there is no
+  # snapshot for this key
+  def load_snapshot(cache_dir, _filter1, _filter2, snapshot_key):
+    filename = Geo.snapshot_filename(cache_dir, _filter1, _filter2)
+    header = Geo.snapshot_magic + snapshot_key
+    try:
+      with open(filename, "rb") as snapshot_file, \
+          mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+        if snapshot[:len(header)] != header:
+          return None
+        with memoryview(snapshot) as view:
+          return pickle.loads(view[len(header):])
+    except (OSError, ValueError, pickle.UnpicklingError) as e:
+      print(f"### Could not load atlas snapshot '{filename}': {e}")
+      return None
+
+  # Write the current atlas to the snapshot
+  def save_snapshot(cache_dir, _filter1, _filter2, snapshot_key):
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = Geo.snapshot_filename(cache_dir, _filter1, _filter2)
+    with open(filename + ".tmp", "wb") as snapshot_file:
+      snapshot_file.write(Geo.snapshot_magic + snapshot_key)
+      pickle.dump(Geo.atlas, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + ".tmp", filename)
   
 
   # Initialize the atlas datastructure with information from the map
@@ -51,93 +282,118 @@ class Geo:
   #
   # The atlas datastructure has hardcoded information about countries
   # and states. This function adds cities and venues into that structure.
+  #
+  # The map pins are read and added to the atlas one at a time, so memory
+  # use does not grow with the size of the map.
   def init_from_livedata(geo_filename = None):
+    for live in Geo.iter_livedata(geo_filename):
+      Geo.add_pin(live)
+    #print(f"Atlas={Geo.atlas}")
+
+  # Yield the map pins from the map database, one by one, as they are
+  # parsed from the file or from the body of the web reply
+  def iter_livedata(geo_filename = None, header = None):
     if geo_filename:
       with open(geo_filename, "rt", encoding="utf-8") as source_file:
-        livedata = json.loads(source_file.read())
+        yield from iter_array_items(read_chunks(source_file), 'data', header)
     else:
-      reply = requests.get("https://allforeco.github.io/fridaysforfuture/fff-global-map.json")
+      reply = requests.get(Geo.livedata_url, stream=True)
       if reply.status_code != 200:
         raise Exception("Could not download fff data from servers")
-      livedata = reply.json()
-    country_names = Geo.atlas['Earth'][1]
-    
-    # Loop over all the map pins
-    for live in livedata['data']:
-      # If a map pin doesn't have "Town" information, it's broken, skip it
-      if 'Town' not in live: continue
-      #print(f"live={live}")
-
-      # Split town and venue names from map pin data
-      live_city_venue = Geo.get_city_name(live['Town']).split(', ')
-      live_city = live_city_venue[-1]
-      live_venue = live_city_venue[-2] if len(live_city_venue) > 1 else None
-
-      # Split country and state names from map pin data
-      live_country_state = Geo.get_city_name(live['Country']).split('--')
-      live_country = live_country_state[0]
-      if live_country not in Geo.atlas['Earth'][1]:
-        if live_country in Geo.canonical_names[Geo.COUNTRY]:
-          live_country = Geo.canonical_names[Geo.COUNTRY][live_country]
-        else:
-          # The country name is not in the atlas structure, skip this pin
-          print(f"Skipping country {live_country}")
-          continue
-      if len(live_country_state) > 1: 
-        # This pin is in a country which has states
-        live_state = live_country_state[1] 
-        if live_state not in Geo.atlas['Earth'][1][live_country][1]:
-          if live_state in Geo.canonical_names[Geo.STATE][live_country]:
-            live_state = Geo.canonical_names[Geo.STATE][live_country][live_state]
-        #print(f"Adding {live_country}:{live_state}:{live_city}")
-        if Geo.atlas['Earth'][1][live_country] == Geo.Z:
-          Geo.atlas['Earth'][1][live_country] = (Geo.STATE, {})
-        if live_state not in Geo.atlas['Earth'][1][live_country][1] or Geo.atlas['Earth'][1][live_country][1][live_state] == Geo.Z:
-          Geo.atlas['Earth'][1][live_country][1][live_state] = (Geo.CITY, {})
-        if live_venue:
-          # This map pin has a venue
-          if live_city not in Geo.atlas['Earth'][1][live_country][1][live_state][1]:
-            Geo.atlas['Earth'][1][live_country][1][live_state][1][live_city] = (Geo.VENUE, {})
-          Geo.atlas['Earth'][1][live_country][1][live_state][1][live_city][1][live_venue] = Geo.Z
-        else:
-          # This map pin doesn't have a venue
-          Geo.atlas['Earth'][1][live_country][1][live_state][1][live_city] = Geo.Z
-      else:
-        # This pin is in a country which doesn't have states
-        #print(f"Adding {live_country}:{live_city}")
-        if live_country in Geo.atlas['Earth'][1]:
-          if Geo.atlas['Earth'][1][live_country] == Geo.Z:
-            Geo.atlas['Earth'][1][live_country] = (Geo.CITY, {})
-          if live_venue:
-            # This map pin has a venue
-            if live_city not in Geo.atlas['Earth'][1][live_country][1]:
-              Geo.atlas['Earth'][1][live_country][1][live_city] = (Geo.VENUE, {})
-            Geo.atlas['Earth'][1][live_country][1][live_city][1][live_venue] = Geo.Z
-          else:
-            # This map pin doesn't have a venue
-            Geo.atlas['Earth'][1][live_country][1][live_city] = Geo.Z
-    #print(f"Atlas={Geo.atlas}")
+      reply.encoding = "utf-8"
+      with reply:
+        yield from iter_array_items(
+          reply.iter_content(chunk_size, decode_unicode=True), 'data', header)
+
+  # Add the city and venue of a single map pin to the atlas
+  def add_pin(live):
+    path = Geo.resolve_pin(live)
+    if path:
+      Geo.add_path(path)
+
+  # Returns the atlas path (country, state, city, venue) for a map pin,
+  # where state and venue may be None, or None if the pin should not be
+  # in the atlas
+  def resolve_pin(live):
+    # If a map pin doesn't have "Town" information, it's broken, skip it
+    if 'Town' not in live: return None
+    #print(f"live={live}")
+
+    # Split town and venue names from map pin data
+    live_city_venue = Geo.get_city_name(live['Town']).split(', ')
+    live_city = live_city_venue[-1]
+    live_venue = live_city_venue[-2] if len(live_city_venue) > 1 else None
+
+    # Split country and state names from map pin data
+    live_country_state = Geo.get_city_name(live['Country']).split('--')
+    live_country = live_country_state[0]
+    countries = Geo.atlas['Earth'][1]
+    if live_country not in countries:
+      live_country = Geo.canonical_names[Geo.COUNTRY].get(live_country)
+      if live_country not in countries:
+        # The country name is not in the atlas structure, skip this pin
+        print(f"Skipping country {live_country_state[0]}")
+        return None
+    live_state = None
+    if len(live_country_state) > 1: 
+      # This pin is in a country which has states
+      live_state = live_country_state[1] 
+      country_info = countries[live_country]
+      if country_info == Geo.Z or live_state not in country_info[1]:
+        live_state = Geo.canonical_names[Geo.STATE].get(live_country, {}).get(live_state, live_state)
+    return (live_country, live_state, live_city, live_venue)
+
+  # Add a city or venue to the atlas, given its atlas path
+  def add_path(path):
+    (live_country, live_state, live_city, live_venue) = path
+    #print(f"Adding {live_country}:{live_state}:{live_city}")
+    countries = Geo.atlas['Earth'][1]
+    parent = countries.get(live_country)
+    if live_state:
+      # This pin is in a country which has states
+      if not parent:
+        parent = countries[live_country] = (Geo.STATE, {})
+      states = parent[1]
+      parent = states.get(live_state)
+      if not parent:
+        parent = states[live_state] = (Geo.CITY, {})
+    elif not parent:
+      # This pin is in a country which doesn't have states
+      parent = countries[live_country] = (Geo.CITY, {})
+    cities = parent[1]
+    if live_venue:
+      # This map pin has a venue
+      city = cities.get(live_city)
+      if not city:
+        city = cities[live_city] = (Geo.VENUE, {})
+      if live_venue not in city[1]:
+        city[1][live_venue] = Geo.Z
+    elif live_city not in cities:
+      # This map pin doesn't have a venue
+      cities[live_city] = Geo.Z
+    elif cities[live_city] is not Geo.Z:
+      # This map pin doesn't have a venue, but the city had venues
+      cities[live_city] = Geo.Z
 
   # This function removes unwanted words from the Town name, as 
   # received from Google Maps. Names often contain Zip codes, or 
   # unwanted words like "Prefecture" or "Municipality"
+  #
+  # The clean_word pattern matches exactly the space separated words we
+  # want to keep: words without digits or parentheses, that are not one
+  # of the unwanted words. So a single findall() does the whole job.
+  clean_word = re.compile(
+    r'(?<![^ ])(?!(?:Municipality|Prefecture|District)(?![^ ]))[^ 0-9()]+(?![^ ])')
   def clean_zip(name_with_zip):
-    def is_clean_word(word):
-      tipp = "0123456789()"
-      for ch in word:
-        if ch in tipp:
-          return False
-      return True
-    name_words = name_with_zip.split(" ")
-    clean_name = []
-    # We don't want words containing these characters and words
-    for name_word in name_words:
-      if is_clean_word(name_word) and name_word not in ['Municipality', 'Prefecture', 'District']:
-        clean_name += [name_word]
-    result = " ".join([w for w in clean_name if w != ''])
-    return result
+    return " ".join(Geo.clean_word.findall(name_with_zip))
 
   # Returns the actual city name part of a Google Maps name
+  #
+  # The same few thousand names come back for every run and many pins,
+  # so results are memoized. Hit and miss counts are available through
+  # Geo.get_city_name.cache_info()
+  name_cache_size = 16 * 1024
+  @lru_cache(maxsize=name_cache_size)
   def get_city_name(raw_city_name):
     return Geo.clean_zip(raw_city_name.split(",")[-1])
 
@@ -146,21 +402,20 @@ class Geo:
   def get_label(geo_info):
     return geo_info[0] if isinstance(geo_info, tuple) else geo_info
 
-  # Returns the location tuple for a given atlas path
+  # Returns the location tuple for a given atlas path, or None if the
+  # path does not lead to one
   def get_named_loc(geo_path):
-    p = Geo.atlas["Earth"]
-    for pname in geo_path:
-      if p == None:
-        print(f"### geo_get_path({geo_path}): {pname} not found")
-        return None
-      if not isinstance(p, tuple):
-        print(f"### geo_get_path({geo_path}): {pname} gives '{p}', strange format")
-        return None
-      if pname in p[1]:
-        p = p[1][pname]
-      else:
-        return None
-    return p
+    return Geo.walk(Geo.atlas['Earth'], geo_path)
+
+  # Returns the location at the end of path, starting from geo_info, or
+  # None. Names that are Z (None) or missing end the walk.
+  def walk(geo_info, path):
+    try:
+      for pname in path:
+        geo_info = geo_info[1].get(pname)
+    except TypeError:
+      return None
+    return geo_info
 
   # Return the subcategory string ("country", etc) from a location tuple
   def get_subcat(geo_tuple):
@@ -351,52 +606,68 @@ class Geo:
       ##  }),
       
     
-    # file to read geo data from
-    geo_data_filename = "filtered_geo_data.csv"
-    
-    # columns in geo_data_filename
-    col_filter1 = 0
-    col_filter2 = 1
-    col_country = 2
-    col_state = 3
-    
-    f = open(geo_data_filename, "r", encoding="latin-1")
-    # skip the first line which is the header line
-    line = f.readline() 
-    
     countries = {}
-    for line in f:
-      words = [x.strip() for x in line.split(',')]
-        
-      # check if the filters match
-      if len(_filter1) > 0 and words[col_filter1] != _filter1:
-        continue
-      if len(_filter2) > 0 and words[col_filter2] != _filter2:
-        continue
-        
-      # if we got this far, both filters are OK    
-      country = words[col_country]
-          
-      if len(words[col_state])==0: # this country does not have states
-        if country in countries:
-            print('Country ' + country + ' has already been added, is this a duplicate?')
-        else: # add the country
-          countries[country] = Geo.Z                
-      else: # this country does have states to add
-        state = words[col_state]
-        if not country in countries:
-            # this is the first state
-            states = {}
-        # add the new state
-        states[state] = Geo.Z
-        # add the states to the country
-        country = (Geo.STATE, states)
-        # add the country again
-        countries[words[col_country]] = country
-
+    for (country, states) in Geo.filter_georef(_filter1, _filter2):
+      countries[country] = (Geo.STATE, dict.fromkeys(states, Geo.Z)) if states else Geo.Z
     countries = (Geo.COUNTRY, countries)
     atlas = {'Earth': countries}    
     return atlas
+
+  # The geo-reference index holds the contents of Geo.geo_data_filename,
+  # as {region: {district: {country: [state, ...]}}}, with the countries
+  # and states in file order. It is read once, and read again only if
+  # the file changes.
+  georef = None
+  georef_order = None
+  georef_stamp = None
+
+  def load_georef():
+    stat = os.stat(Geo.geo_data_filename)
+    stamp = (Geo.geo_data_filename, stat.st_mtime_ns, stat.st_size)
+    if Geo.georef_stamp == stamp:
+      return Geo.georef
+    georef = {}
+    # The position of each country in the file, for keeping file order
+    # when countries from several regions or districts are combined
+    Geo.georef_order = {}
+    with open(Geo.geo_data_filename, "r", encoding="latin-1", newline='') as f:
+      rows = csv.reader(f)
+      # skip the first line which is the header line
+      next(rows)
+      for row in rows:
+        (region, district, country, state) = [sys.intern(x.strip()) for x in row[:4]]
+        states = georef.setdefault(region, {}).setdefault(district, {}).get(country)
+        if states is None:
+          states = georef[region][district][country] = []
+          Geo.georef_order.setdefault(country, len(Geo.georef_order))
+        elif not state or not states:
+          print('Country ' + country + ' has already been added, is this a duplicate?')
+        if state and state not in states:
+          states.append(state)
+    (Geo.georef, Geo.georef_stamp) = (georef, stamp)
+    return georef
+
+  # Returns (country, [state, ...]) for the countries that match the
+  # filters, in file order. Each filter is a region (or district) name,
+  # several names separated by commas, or empty to match all. A country
+  # without states has an empty list.
+  def filter_georef(_filter1, _filter2):
+    georef = Geo.load_georef()
+    regions = Geo.split_filter(_filter1) or list(georef)
+    districts = Geo.split_filter(_filter2)
+    countries = {}
+    for region in regions:
+      region_districts = georef.get(region, {})
+      for district in districts or list(region_districts):
+        for (country, states) in region_districts.get(district, {}).items():
+          merged = countries.setdefault(country, [])
+          merged += [state for state in states if state not in merged]
+    return sorted(countries.items(), key=lambda item: Geo.georef_order[item[0]])
+
+  def split_filter(_filter):
+    if isinstance(_filter, str):
+      _filter = _filter.split(',')
+    return [name.strip() for name in _filter if name.strip()]
     
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -0,0 +1,183 @@
+#   FridaysForFuture TypeForm Input Generator
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re, json, tempfile
+
+# Helpers for reading and writing large JSON documents piece by piece, so that
+# e.g. the FFF global map never has to be held in memory as a whole.
+
+chunk_size = 64 * 1024
+_whitespace = re.compile(r'[ \t\n\r]*')
+_number_chars = re.compile(r'[0-9.eE+-]*')
+
+# Read a text file in fixed size chunks
+def read_chunks(source_file, size = chunk_size):
+  return iter(lambda: source_file.read(size), '')
+
+# Keeps a window of text over a stream of chunks, and decodes one JSON
+# value at a time from it. Text that has been consumed is dropped the
+# next time a chunk is read, so the window never grows much beyond the
+# size of the largest single value plus one chunk.
+class _ChunkReader:
+  def __init__(self, text_chunks):
+    self.chunks = iter(text_chunks)
+    self.decoder = json.JSONDecoder()
+    self.buf = ''
+    self.pos = 0
+    self.eof = False
+
+  # Append the next chunk to the window. Returns False at end of input
+  def fill(self):
+    for chunk in self.chunks:
+      if chunk:
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+    self.eof = True
+    return False
+
+  # Return the next non-whitespace character, without consuming it,
+  # or None at end of input
+  def peek(self):
+    while True:
+      self.pos = _whitespace.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self.fill():
+        return None
+
+  # Consume the next non-whitespace character, which must be one of chars
+  def expect(self, chars):
+    ch = self.peek()
+    if ch is None or ch not in chars:
+      raise Exception(f"Malformed JSON: expected one of '{chars}', got '{ch}'")
+    self.pos += 1
+    return ch
+
+  # Consume the members of an array or object, whose opening bracket
+  # has just been consumed. Yields before each member, and returns after
+  # the closing bracket. A comma must be followed by another member.
+  def members(self, close):
+    if self.peek() == close:
+      self.pos += 1
+      return
+    while True:
+      yield
+      if self.expect(',' + close) == close:
+        return
+
+  # Decode the next complete JSON value, reading more chunks until the
+  # whole value is inside the window. A number may be cut off at the end
+  # of the window, e.g. '1.' of '1.5', and the decoder would then return
+  # just the part before the cut. So a number is only trusted when there
+  # is something after it that can't be part of it, or at end of input.
+  def value(self):
+    self.peek()
+    while True:
+      try:
+        (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+          end_of_number = _number_chars.match(self.buf, end).end()
+        else:
+          end_of_number = end
+        if end_of_number < len(self.buf) or self.eof:
+          self.pos = end
+          return value
+      except json.JSONDecodeError:
+        if self.eof:
+          raise
+      self.fill()
+
+# Decode the members of one array in a top-level JSON object, yielding
+# the array items one by one as they are read from text_chunks (any
+# iterable of str, e.g. read_chunks() over a file, or the decoded body of
+# a streamed HTTP response). Other top-level members are decoded whole,
+# and stored in the header dict if one is given.
+def iter_array_items(text_chunks, array_key, header = None):
+  reader = _ChunkReader(text_chunks)
+  reader.expect('{')
+  for _ in reader.members('}'):
+    key = reader.value()
+    reader.expect(':')
+    if key == array_key and reader.peek() == '[':
+      reader.expect('[')
+      for _ in reader.members(']'):
+        yield reader.value()
+    else:
+      value = reader.value()
+      if header is not None:
+        header[key] = value
+  # Read to the end, so that the input is fully consumed and checked
+  if reader.peek() is not None:
+    raise Exception("Malformed JSON: extra data after the top-level object")
+
+# Write obj, a dict, to out as JSON. The output is the same as from
+# out.write(json.dumps(obj, indent=indent)), except that without indent
+# it is made as compact as possible.
+#
+# Additional list items can be streamed into the top-level lists of obj,
+# as (key, item) pairs from records. Items for obj[key] are inserted
+# before position positions[key]. Each item is encoded and written as
+# soon as it comes, or, if it belongs to a list that comes later in obj,
+# spooled to a temporary file until that list is written. Memory use does
+# therefore not grow with the number of records.
+def write_json(out, obj, indent = None, records = (), positions = {}):
+  if indent is None:
+    (separators, newline1, newline2, newline0) = ((',', ':'), '', '', '')
+  else:
+    separators = (',', ': ')
+    (newline0, newline1, newline2) = ('\n', '\n' + ' ' * indent, '\n' + ' ' * (2 * indent))
+  records = iter(records)
+  spools = {}
+
+  def encode(value, newline):
+    return json.dumps(value, indent=indent, separators=separators).replace('\n', newline)
+
+  # Yield the encoded items of records for key, spooling the others
+  def record_items(key):
+    if key in spools:
+      spools[key].seek(0)
+      for line in spools[key]:
+        yield encode(json.loads(line), newline2)
+      spools[key].close()
+      return
+    for (record_key, item) in records:
+      if record_key == key:
+        yield encode(item, newline2)
+      else:
+        if record_key not in spools:
+          spools[record_key] = tempfile.TemporaryFile("w+t", encoding="utf-8")
+        spools[record_key].write(json.dumps(item) + '\n')
+
+  def list_items(key, value):
+    position = positions[key]
+    yield from (encode(item, newline2) for item in value[:position])
+    yield from record_items(key)
+    yield from (encode(item, newline2) for item in value[position:])
+
+  out.write('{')
+  for (n, (key, value)) in enumerate(obj.items()):
+    out.write((separators[0] if n else '') + newline1 + json.dumps(key) + separators[1])
+    if key not in positions:
+      out.write(encode(value, newline1))
+      continue
+    out.write('[')
+    count = 0
+    for text in list_items(key, value):
+      out.write((separators[0] if count else '') + newline2 + text)
+      count += 1
+    out.write((newline1 if count else '') + ']')
+  out.write((newline0 if obj else '') + '}')
@@ -0,0 +1,180 @@
+#   FridaysForFuture TypeForm Input Generator
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json, time, threading, itertools
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A local stand-in for the TypeForm API, for trying out and benchmarking
+# tyffin and tyffout without touching real forms. It keeps forms and
+# responses in memory, and serves the endpoints that tyffin_typeform
+# uses. It can be made slow (latency), rate limited (rate requests per
+# second, answering 429 above that), and unreliable (every fail_every:th
+# request answers 500). Like TypeForm, it deletes at most max_delete
+# responses per request.
+#
+# Usage:
+#   with MockTypeform(forms={'abcdef': form}) as mock:
+#     os.environ['TYPEFORM_API_URL'] = mock.url
+#     ...
+
+class MockTypeform:
+  max_delete = 1000
+
+  def __init__(self, forms = None, responses = None, latency = 0.0, rate = None,
+               fail_every = 0):
+    self.forms = dict(forms or {})
+    # Responses per form, newest first, as TypeForm lists them
+    self.responses = {uid: list(items) for (uid, items) in (responses or {}).items()}
+    self.latency = latency
+    self.rate = rate
+    self.fail_every = fail_every
+    self.stats = Counter()
+    self.lock = threading.Lock()
+    self.count = itertools.count(1)
+    self.recent = []
+    self.server = None
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  def start(self):
+    handler = type('Handler', (MockTypeformHandler,), {'mock': self})
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    self.server.daemon_threads = True
+    self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  # Decide how to treat a request: None to serve it, or an error status
+  def admit(self):
+    with self.lock:
+      n = next(self.count)
+      now = time.monotonic()
+      self.recent = [stamp for stamp in self.recent if stamp > now - 1.0]
+      if self.rate and len(self.recent) >= self.rate:
+        self.stats['429'] += 1
+        return 429
+      self.recent.append(now)
+      if self.fail_every and n % self.fail_every == 0:
+        self.stats['500'] += 1
+        return 500
+    return None
+
+  # Returns one page of responses to a form, like TypeForm: newest first,
+  # or after/before the response with the given token
+  def list_responses(self, uid, query):
+    def arg(name, default = None):
+      return query.get(name, [default])[0]
+    items = self.responses.get(uid, [])
+    if arg('completed') is not None:
+      completed = arg('completed') == 'true'
+      items = [item for item in items if ('submitted_at' in item) == completed]
+    if arg('since'):
+      items = [item for item in items if item.get('submitted_at', item['landed_at']) >= arg('since')]
+    if arg('until'):
+      items = [item for item in items if item.get('submitted_at', item['landed_at']) <= arg('until')]
+    if arg('included_response_ids'):
+      included = set(arg('included_response_ids').split(','))
+      items = [item for item in items if item['token'] in included]
+    total = len(items)
+    tokens = [item['token'] for item in items]
+    if arg('before') in tokens:
+      items = items[tokens.index(arg('before')) + 1:]
+    elif arg('after') in tokens:
+      items = items[:tokens.index(arg('after'))]
+    page_size = min(int(arg('page_size', 25)), 1000)
+    return {
+      'total_items': total,
+      'page_count': (total + page_size - 1) // page_size,
+      'items': items[:page_size],
+    }
+
+class MockTypeformHandler(BaseHTTPRequestHandler):
+  mock = None
+
+  def log_message(self, format, *args):
+    pass
+
+  def reply(self, status, body = None):
+    data = json.dumps(body).encode("utf-8") if body is not None else b''
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def handle_request(self, method):
+    mock = self.mock
+    url = urlparse(self.path)
+    parts = url.path.strip('/').split('/')
+    length = int(self.headers.get('Content-Length') or 0)
+    data = json.loads(self.rfile.read(length)) if length else None
+    mock.stats[method] += 1
+    if mock.latency:
+      time.sleep(mock.latency)
+    if not self.headers.get('Authorization', '').startswith('bearer '):
+      return self.reply(403, {'code': 'AUTHENTICATION_FAILED', 'description': "Authentication failed"})
+    error = mock.admit()
+    if error:
+      return self.reply(error, {'description': "Mock failure"} if error != 429 else None)
+    if len(parts) < 2 or parts[0] != 'forms' or parts[1] not in mock.forms:
+      return self.reply(404, {'code': 'FORM_NOT_FOUND', 'description': "Form not found"})
+    uid = parts[1]
+    with mock.lock:
+      if len(parts) == 2 and method == 'GET':
+        return self.reply(200, mock.forms[uid])
+      if len(parts) == 2 and method == 'PUT':
+        form = dict(data, id=uid)
+        for field in form.get('fields', []):
+          field.setdefault('id', f"mock{next(mock.count)}")
+        mock.forms[uid] = form
+        return self.reply(200, form)
+      if len(parts) == 2 and method == 'PATCH':
+        for op in data:
+          mock.forms[uid][op['path'].strip('/')] = op['value']
+        return self.reply(204)
+      if parts[2:] == ['responses'] and method == 'GET':
+        return self.reply(200, mock.list_responses(uid, parse_qs(url.query)))
+      if parts[2:] == ['responses'] and method == 'DELETE':
+        tokens = set(parse_qs(url.query).get('included_tokens', [''])[0].split(','))
+        if len(tokens) > mock.max_delete:
+          return self.reply(400, {'code': 'VALIDATION_ERROR',
+                                  'description': f"At most {mock.max_delete} tokens per request"})
+        mock.responses[uid] = [item for item in mock.responses.get(uid, [])
+                               if item['token'] not in tokens]
+        return self.reply(200)
+    self.reply(405, {'code': 'METHOD_NOT_ALLOWED', 'description': "Not supported by the mock"})
+
+  def do_GET(self):
+    self.handle_request('GET')
+
+  def do_PUT(self):
+    self.handle_request('PUT')
+
+  def do_PATCH(self):
+    self.handle_request('PATCH')
+
+  def do_DELETE(self):
+    self.handle_request('DELETE')
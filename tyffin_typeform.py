@@ -0,0 +1,217 @@
+#   FridaysForFuture TypeForm Input Generator
+#   Copyright (C) 2020 Jan Lindblad, Lena Douglas
+# 
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+# 
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+# 
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os, json, time, random, asyncio, threading, atexit
+from urllib.parse import urlencode
+import aiohttp
+
+# Client for the TypeForm API endpoints that tyffin and tyffout use.
+#
+# AsyncTypeform does the work on asyncio: all requests share one pooled
+# keep-alive session, go through a token bucket so that TypeForm's rate
+# limit is not exceeded, and are retried with exponential backoff when
+# TypeForm answers 429 (too many requests) or 5xx, or the connection
+# fails. Requests for several forms can run concurrently.
+#
+# Typeform is a synchronous front for it, with the same interface as
+# the typeform SDK (forms.get/update, responses.list/delete), so it can
+# be used in its place. It runs the event loop in a background thread,
+# which any number of threads can share.
+
+api_base_url = "https://api.typeform.com"
+# Set this environment variable to use another server, e.g. a MockTypeform
+api_url_env = 'TYPEFORM_API_URL'
+
+# Allows rate requests per second on average, and bursts of up to burst
+# requests at once
+class TokenBucket:
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.stamp = time.monotonic()
+    self.lock = None
+
+  async def acquire(self):
+    # The lock is made here, so that it belongs to the running event loop
+    if not self.lock:
+      self.lock = asyncio.Lock()
+    async with self.lock:
+      while True:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Encode query parameters the way the typeform SDK does: None values are
+# left out, lists are comma separated, and booleans are true/false
+def encode_params(params):
+  clean = {}
+  for (key, value) in (params or {}).items():
+    if value is None:
+      continue
+    if isinstance(value, list):
+      value = ",".join(value)
+    elif isinstance(value, bool):
+      value = "true" if value else "false"
+    clean[key] = value
+  return urlencode(clean)
+
+class AsyncTypeform:
+  # TypeForm allows 2 requests per second per account
+  def __init__(self, token, base_url = None, rate = 2.0, burst = 2, connections = 8,
+               retries = 5, backoff = 0.5):
+    self.base_url = (base_url or os.environ.get(api_url_env) or api_base_url).rstrip("/")
+    self.headers = {
+      'Content-Type': 'application/json',
+      'Accept': 'application/json',
+      'Authorization': f"bearer {token}",
+    }
+    self.bucket = TokenBucket(rate, burst)
+    self.connections = connections
+    self.retries = retries
+    self.backoff = backoff
+    self.session = None
+    self.stats = {'requests': 0, 'retries': 0}
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.close()
+
+  async def close(self):
+    if self.session:
+      await self.session.close()
+      self.session = None
+
+  # Send a request, and return the decoded JSON body, or 'OK' if the body
+  # is empty, like the typeform SDK. Raises an Exception on errors that
+  # remain after all retries.
+  async def request(self, method, path, data = None, params = None):
+    if not self.session:
+      self.session = aiohttp.ClientSession(headers=self.headers,
+        connector=aiohttp.TCPConnector(limit=self.connections))
+    url = self.base_url + path
+    query = encode_params(params)
+    if query:
+      url += "?" + query
+    body = json.dumps(data) if data else None
+    for attempt in range(self.retries + 1):
+      await self.bucket.acquire()
+      self.stats['requests'] += 1
+      try:
+        async with self.session.request(method, url, data=body) as reply:
+          text = await reply.text()
+          retry_after = reply.headers.get('Retry-After')
+          status = reply.status
+      except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        (status, retry_after, text) = (None, None, str(error))
+      if status is not None and status != 429 and status < 500:
+        return AsyncTypeform.decode_reply(status, text)
+      if attempt == self.retries:
+        raise Exception(f"TypeForm {method} {path} failed after {attempt + 1} attempts: "
+                        f"{status or text}")
+      self.stats['retries'] += 1
+      delay = self.backoff * 2 ** attempt * (1 + random.random())
+      if retry_after and retry_after.isdigit():
+        delay = max(delay, int(retry_after))
+      await asyncio.sleep(delay)
+
+  def decode_reply(status, text):
+    try:
+      body = json.loads(text)
+    except ValueError:
+      body = {}
+    if isinstance(body, dict) and body.get('code') is not None:
+      raise Exception(body.get('description'))
+    if status >= 400:
+      raise Exception(f"TypeForm request failed: {status}")
+    return body if text else 'OK'
+
+  async def get_form(self, uid):
+    return await self.request('GET', f"/forms/{uid}")
+
+  # PUT returns the updated form, PATCH returns 'OK'
+  async def update_form(self, uid, data, patch = False):
+    return await self.request('PATCH' if patch else 'PUT', f"/forms/{uid}", data=data)
+
+  async def list_responses(self, uid, **params):
+    return await self.request('GET', f"/forms/{uid}/responses", params=params)
+
+  async def delete_responses(self, uid, tokens):
+    return await self.request('DELETE', f"/forms/{uid}/responses",
+                              params={'included_tokens': tokens})
+
+# Synchronous front for AsyncTypeform, see above
+class Typeform:
+  def __init__(self, token, **options):
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+    self.thread.start()
+    self.client = AsyncTypeform(token, **options)
+    self.forms = TypeformForms(self)
+    self.responses = TypeformResponses(self)
+    atexit.register(self.close)
+
+  # Run a coroutine on the event loop, and return its result
+  def run(self, coro):
+    return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+  # Run coroutines concurrently, and return their results in order
+  def run_all(self, coros):
+    async def gather():
+      return await asyncio.gather(*coros)
+    return self.run(gather())
+
+  def close(self):
+    if not self.thread.is_alive():
+      return
+    self.run(self.client.close())
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+    atexit.unregister(self.close)
+
+class TypeformForms:
+  def __init__(self, typeform):
+    self.typeform = typeform
+
+  def get(self, uid):
+    return self.typeform.run(self.typeform.client.get_form(uid))
+
+  # Fetch several forms concurrently
+  def get_many(self, uids):
+    return self.typeform.run_all([self.typeform.client.get_form(uid) for uid in uids])
+
+  def update(self, uid, data = {}, patch = False):
+    return self.typeform.run(self.typeform.client.update_form(uid, data, patch))
+
+class TypeformResponses:
+  def __init__(self, typeform):
+    self.typeform = typeform
+
+  def list(self, uid, pageSize = None, since = None, until = None, after = None, before = None,
+           includedResponseIds = None, completed = None, sort = None, query = None, fields = None):
+    return self.typeform.run(self.typeform.client.list_responses(uid,
+      page_size=pageSize, since=since, until=until, after=after, before=before,
+      included_response_ids=includedResponseIds, completed=completed, sort=sort,
+      query=query, fields=fields))
+
+  def delete(self, uid, includedTokens):
+    return self.typeform.run(self.typeform.client.delete_responses(uid, includedTokens))
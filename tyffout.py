@@ -17,16 +17,28 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import sys, os
-import json
-from typeform import Typeform
+import json, asyncio, time, csv
+from tyffin_typeform import Typeform
+from tyffin import Formtree
+import tyffin_columns
 
-# This program retrieves the responses from a TypeForm form, stored in a dictionary and
-# written to an outputfile. The form is identified through:
+# This program retrieves the responses from a TypeForm form, and streams them to
+# an outputfile. The form is identified through:
 form_id = 'FORM_ID_HERE' # replace with the current form_id
 token_env = 'TYPEFORM_TOKEN' # stored in system environmental variables
 
 # If no outputfile is given the responses are only written to the screen, else to the file.
-output_file = 'response_output_file.txt' # or None to only print to screen
+# The file gets one response per line, as JSON (NDJSON). If the retrieval is interrupted,
+# it is resumed from where it stopped the next time, see export_responses().
+output_file = 'response_output_file.ndjson' # or None to only print to screen
+
+# Responses are retrieved in pages of this many, the most TypeForm allows
+page_size = 1000
+
+# Responses are deleted in chunks of this many, the most TypeForm allows in one request,
+# with this many requests at once
+delete_chunk_size = 1000
+delete_concurrency = 4
 
 # All responses to the TypeForm form are retrieved without any limits, except to which type
 # of entries that should be fetched, as controlled by the following parameter:
@@ -39,72 +51,336 @@ only_completed_entries = None
 #   - if True the responses will be deleted after writing to file
 delete_after_retrieving = True
 
-# FIXME: Now all response items data is fetched, the resulting dictionary probably needs formatting.
+# The responses in the output file can also be flattened into tables, with one row per
+# response and one column per question, see flatten_responses():
+#   - if True a .csv file and a .tcol column file (see tyffin_columns) are written next
+#     to the output file
+flatten_output = True
+
+# Incremental sync, for scheduled runs, see sync_responses():
+#   - if True only responses newer than those already in the output file are fetched,
+#     and added to it. Only responses that are safely in the output file are deleted,
+#     without asking.
+#   - if False all responses are fetched, and the output file is overwritten
+incremental_sync = False
+
 # FIXME: If all entries are fetched, i.e. both completed and not completed, 
 #        only the completed ones should probably be written to file. 
 # FIXME: Possibly only the completed ones should be deleted?
-# FIXME: If not all data is fetched every time some of the settings for responses.list() will need to be adjusted.
 
 #-------------------------------------------------------------
-def fetch_responses_dict(responses, form_id, completed_entries_only):
-    
-    # settings for fetching the responses
-    completed = completed_entries_only
-    
-    # no other limits for now, fetch all
-    # parametrizing all anyway, for clarity
-    page_size = None #maximum
-    since = None 
-    until = None
-    after = None
-    before = None
-    included_response_ids = None
-    sort = None
-    query = None
-    fields = None
-    
-    # fetch a typeform response list
-    output = responses.list(form_id, page_size, since, until, after, before, 
-                            included_response_ids, completed, sort, query, fields)
-    # create output dictionary
-    dict = {}
-    dict['total_items'] = output['total_items']
-    dict['page_count'] = output['page_count']
-    dict['items'] = output['items']
-    
-    return dict
+async def export_responses(client, form_id, completed_entries_only, output_file, since = None):
+    # Fetch all responses page by page, newest first, walking the 'before'
+    # token cursor: each page asks for the responses before the last one on
+    # the previous page. The next page is fetched while the current one is
+    # written, and only one page is held in memory at a time.
+    #
+    # Progress is saved in a resume file next to the output file after each
+    # page, with the cursor and the size of the output file at that point.
+    # After an interruption, the output file is cut back to that size, and
+    # retrieval continues from the cursor. The resume file is removed when
+    # all responses have been retrieved.
+    #
+    # If since is given, only responses submitted since then are retrieved.
+    #
+    # Returns the number of responses written
+    resume = load_resume(output_file, form_id, completed_entries_only, since)
+    (before, count) = (resume['before'], resume['count'])
+    if before:
+        print(f"Resuming after {count} responses")
+    out = open(output_file, "ab", buffering=0) if output_file else sys.stdout.buffer
+    try:
+        if output_file:
+            out.truncate(resume['offset'])
+            out.seek(resume['offset'])
+        page = asyncio.ensure_future(client.list_responses(form_id, page_size=page_size,
+                                     before=before, since=since,
+                                     completed=completed_entries_only))
+        while page:
+            items = (await page)['items']
+            page = None
+            if len(items) == page_size:
+                # fetch the next page while this one is written
+                page = asyncio.ensure_future(client.list_responses(form_id, page_size=page_size,
+                                             before=items[-1]['token'], since=since,
+                                             completed=completed_entries_only))
+            out.write(b''.join(json.dumps(item).encode("utf-8") + b'\n' for item in items))
+            count += len(items)
+            if output_file and items:
+                save_resume(output_file, {'form_id': form_id, 'completed': completed_entries_only,
+                                          'since': since, 'before': items[-1]['token'],
+                                          'count': count, 'offset': out.tell()})
+            print(f"Retrieved {count} responses", file=sys.stderr)
+    finally:
+        if page:
+            page.cancel()
+        if output_file:
+            out.close()
+    if output_file and os.path.exists(output_file + '.resume'):
+        os.remove(output_file + '.resume')
+    return count
+
+#-------------------------------------------------------------
+def load_resume(output_file, form_id, completed_entries_only, since):
+    # returns the saved progress for the output file, if it was for the
+    # same retrieval, otherwise a fresh start
+    fresh = {'before': None, 'count': 0, 'offset': 0}
+    if not output_file:
+        return fresh
+    try:
+        with open(output_file + '.resume', "rt", encoding="utf-8") as f:
+            resume = json.loads(f.read())
+    except (OSError, ValueError):
+        return fresh
+    if (resume.get('form_id'), resume.get('completed'), resume.get('since')) != \
+       (form_id, completed_entries_only, since):
+        return fresh
+    if not os.path.exists(output_file) or os.path.getsize(output_file) < resume['offset']:
+        return fresh
+    return resume
+
+#-------------------------------------------------------------
+def save_resume(output_file, resume):
+    # written to a temporary file first, so that a crash never leaves a
+    # half written resume file
+    with open(output_file + '.resume.tmp', "wt", encoding="utf-8") as f:
+        f.write(json.dumps(resume))
+    os.replace(output_file + '.resume.tmp', output_file + '.resume')
+
+#-------------------------------------------------------------
+def sync_responses(typeform, form_id, completed_entries_only, output_file):
+    # Incremental sync: fetch only the responses submitted since the newest
+    # one already in the output file (the high-water mark), and append them
+    # to it. Responses are first exported to a pending file next to the
+    # output file. Those not already in the output file are then appended to
+    # it, and the sync state is updated; a response is new unless its token
+    # is among those at the high-water mark, as TypeForm's 'since' includes
+    # the responses at that exact time.
+    #
+    # The sync state also records the size of the output file and the tokens
+    # of the responses in it that are not yet deleted from TypeForm. If a run
+    # is interrupted while appending, the output file is cut back to the
+    # recorded size on the next run.
+    #
+    # Returns the number of responses added
+    state = load_sync_state(output_file, form_id, completed_entries_only)
+    pending_file = output_file + '.new'
+    typeform.run(export_responses(typeform.client, form_id, completed_entries_only,
+                                  pending_file, state['since']))
+    known = set(state['boundary'])
+    added = 0
+    with open(output_file, "ab") as out, open(pending_file, "rb") as pending:
+        out.truncate(state['size'])
+        out.seek(state['size'])
+        for line in pending:
+            item = json.loads(line)
+            if item['token'] in known:
+                continue
+            known.add(item['token'])
+            out.write(line)
+            added += 1
+            state['undeleted'].append(item['token'])
+            submitted = response_time(item)
+            if state['since'] is None or submitted > state['since']:
+                (state['since'], state['boundary']) = (submitted, [])
+            if submitted == state['since']:
+                state['boundary'].append(item['token'])
+        out.flush()
+        os.fsync(out.fileno())
+        state['size'] = out.tell()
+    save_sync_state(output_file, state)
+    os.remove(pending_file)
+    return added
+
+#-------------------------------------------------------------
+def response_time(item):
+    # the time a response was submitted, or for responses that were never
+    # submitted, when the form was opened
+    return item.get('submitted_at') or item['landed_at']
+
+#-------------------------------------------------------------
+def load_sync_state(output_file, form_id, completed_entries_only):
+    fresh = {'form_id': form_id, 'completed': completed_entries_only, 'since': None,
+             'boundary': [], 'size': 0, 'undeleted': []}
+    try:
+        with open(output_file + '.sync', "rt", encoding="utf-8") as f:
+            state = json.loads(f.read())
+    except (OSError, ValueError):
+        if os.path.exists(output_file) and os.path.getsize(output_file):
+            raise Exception(f"Output file '{output_file}' has no sync state, will not add to it")
+        return fresh
+    if state.get('form_id') != form_id or state.get('completed') != completed_entries_only:
+        raise Exception(f"Output file '{output_file}' was synced with another form or setting")
+    if not os.path.exists(output_file) or os.path.getsize(output_file) < state['size']:
+        raise Exception(f"Output file '{output_file}' is shorter than when it was last synced")
+    return state
+
+#-------------------------------------------------------------
+def save_sync_state(output_file, state):
+    with open(output_file + '.sync.tmp', "wt", encoding="utf-8") as f:
+        f.write(json.dumps(state))
+    os.replace(output_file + '.sync.tmp', output_file + '.sync')
+
+#-------------------------------------------------------------
+def delete_synced_responses(typeform, form_id, completed_entries_only, output_file):
+    # delete the responses that are in the output file but not yet deleted
+    # from TypeForm, keeping track of what is deleted
+    state = load_sync_state(output_file, form_id, completed_entries_only)
+    deleted = set(typeform.run(delete_responses(typeform.client, form_id, state['undeleted'],
+                                                output_file + '.deleted')))
+    state['undeleted'] = [token for token in state['undeleted'] if token not in deleted]
+    save_sync_state(output_file, state)
+    os.remove(output_file + '.deleted')
+    print(f"{len(state['undeleted'])} responses remain to be deleted.")
 
 #-------------------------------------------------------------
-def delete_responses_list(responses, form_id, dict):
-    # find all tokens for responses to delete
-    responses_to_delete = []
-    for item in dict['items']:
-        t = item['token']
-        responses_to_delete.append(t) 
+def flatten_responses(form, output_file, batch_size = 10000):
+    # Write the responses in the output file as a table, with one row per
+    # response, to <output>.csv and to the column file <output>.tcol, which
+    # can be loaded one column at a time with tyffin_columns.read_columns().
+    #
+    # The answer to each question goes in the column named by the question
+    # code in its title, e.g. 'E1' for '[E1] ...', or by its ref if it has
+    # no code. The generated location questions share a column per level
+    # and kind ('L1', 'L1b', 'L2 city', 'L2 venue'), see
+    # Formtree.question_column(). Should a response still have several
+    # answers for one column, they are joined with '; '. Answers to
+    # questions that are no longer in the form get columns after those of
+    # the form. Rows are written
+    # batch_size at a time, so the output file is never loaded as a whole.
+    #
+    # Returns the number of rows written
+    ref_columns = {}
+    for field in form.get('fields', []):
+        ref_columns[field['ref']] = Formtree.question_column(field.get('title', '')) or field['ref']
+    # first pass: find the answers to questions that are not in the form
+    for item in iter_responses(output_file):
+        for answer in item.get('answers') or []:
+            ref_columns.setdefault(answer['field']['ref'], answer['field']['ref'])
+    columns = list(dict.fromkeys(['token', 'landed_at', 'submitted_at'] + list(ref_columns.values())))
     
+    rows = 0
+    with open(output_file + '.csv', "wt", encoding="utf-8", newline='') as csv_file, \
+         tyffin_columns.ColumnWriter(output_file + '.tcol') as column_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        batch = []
+        for item in iter_responses(output_file):
+            row = dict.fromkeys(columns)
+            row.update({key: item.get(key) for key in ['token', 'landed_at', 'submitted_at']})
+            for answer in item.get('answers') or []:
+                column = ref_columns[answer['field']['ref']]
+                value = answer_value(answer)
+                row[column] = value if row[column] is None else f"{row[column]}; {value}"
+            batch.append([row[column] for column in columns])
+            if len(batch) == batch_size:
+                write_batch(writer, column_file, columns, batch)
+                rows += len(batch)
+                batch = []
+        if batch:
+            write_batch(writer, column_file, columns, batch)
+            rows += len(batch)
+    return rows
+
+#-------------------------------------------------------------
+def write_batch(writer, column_file, columns, batch):
+    writer.writerows(batch)
+    column_file.write_group({column: list(values) for (column, values) in zip(columns, zip(*batch))})
+
+#-------------------------------------------------------------
+def answer_value(answer):
+    # the value of an answer, as a string, number or boolean
+    value = answer.get(answer['type'])
+    if answer['type'] == 'choice':
+        return value.get('label') or value.get('other')
+    if answer['type'] == 'choices':
+        return "; ".join(value.get('labels', []) + ([value['other']] if value.get('other') else []))
+    if answer['type'] == 'payment':
+        return value.get('amount')
+    return value
+
+#-------------------------------------------------------------
+def iter_responses(output_file):
+    with open(output_file, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+#-------------------------------------------------------------
+def read_tokens(output_file):
+    # read the tokens of all responses in the output file
+    return [item['token'] for item in iter_responses(output_file)]
+
+#-------------------------------------------------------------
+def delete_responses_list(typeform, form_id, responses_to_delete, progress_file):
     if len(responses_to_delete) == 0:
         print("There are no responses to delete.")
         return
     
     # delete the responses
-    print("Responses that will be deleted: ", responses_to_delete)
+    print(f"{len(responses_to_delete)} responses will be deleted.")
     sys.stdout.write("Are you sure you want to delete the responses (y/n)?   ")
     ans = input().lower()    
     if ans == 'y':
-        str = responses.delete(form_id, responses_to_delete)
-        if str == 'OK':
+        deleted = typeform.run(delete_responses(typeform.client, form_id, responses_to_delete,
+                                                progress_file))
+        if len(deleted) == len(responses_to_delete):
             print("Responses have been successfully deleted.")
+            os.remove(progress_file)
         else:
-            print("Delete failed: ", str)
+            print(f"Delete failed for {len(responses_to_delete) - len(deleted)} responses, "
+                  f"run again to delete the rest.")
     return        
 
 #-------------------------------------------------------------
-def write(output_file, dict):
-    # write responses to a local file
-    with open(output_file, "wt", encoding="utf-8") as out:
-        out.write(json.dumps(dict, indent=2))
-    print(f"TypeForm responses have been written to file '{output_file}'")
+async def delete_responses(client, form_id, tokens, progress_file):
+    # Delete responses delete_chunk_size at a time, the most TypeForm takes
+    # in one request, with up to delete_concurrency requests at once. The
+    # client retries requests that fail for a while. The tokens of each
+    # chunk that is deleted are appended to the progress file, and tokens
+    # already in the progress file are not deleted again, so running again
+    # after failures only deletes what is left.
+    #
+    # Returns the list of tokens deleted, including those deleted before
+    start = time.perf_counter()
+    done = set()
+    if os.path.exists(progress_file):
+        with open(progress_file, "rt", encoding="utf-8") as f:
+            done = set(line.strip() for line in f)
+    remaining = [token for token in tokens if token not in done]
+    chunks = [remaining[n:n + delete_chunk_size] for n in range(0, len(remaining), delete_chunk_size)]
+    semaphore = asyncio.Semaphore(delete_concurrency)
+    deleted = [token for token in tokens if token in done]
+    failed = []
     
+    async def delete_chunk(chunk, progress):
+        async with semaphore:
+            try:
+                result = await client.delete_responses(form_id, chunk)
+            except Exception as error:
+                result = str(error)
+        if result == 'OK':
+            progress.write("".join(token + "\n" for token in chunk))
+            progress.flush()
+            deleted.extend(chunk)
+        else:
+            print(f"Delete failed for {len(chunk)} responses: {result}")
+            failed.append(chunk)
+    
+    with open(progress_file, "at", encoding="utf-8") as progress:
+        await asyncio.gather(*[delete_chunk(chunk, progress) for chunk in chunks])
+    elapsed = time.perf_counter() - start
+    failed_count = sum(map(len, failed))
+    count = len(remaining) - failed_count
+    print(f"Deleted {count} responses with {len(chunks)} requests in {elapsed:.2f} s "
+          f"({count / max(elapsed, 1e-6):.0f}/s), {len(failed)} requests failed "
+          f"({failed_count} responses), {len(tokens) - len(remaining)} were deleted before")
+    return deleted
+
+#-------------------------------------------------------------
+def flatten(typeform, form_id, output_file):
+    rows = flatten_responses(typeform.forms.get(form_id), output_file)
+    print(f"{rows} responses have been written to '{output_file}.csv' and '{output_file}.tcol'")
     
 ####################################################################    
 def main():
@@ -115,23 +391,33 @@ def main():
     
     # retrieve the responses     
     print(f"Retreiving TypeForm results for form '{form_id}'")  
-    responses = Typeform(os.environ[token_env]).responses
+    typeform = Typeform(os.environ[token_env])
+    
+    if incremental_sync and output_file:
+        # add the new responses to the output file
+        count = sync_responses(typeform, form_id, only_completed_entries, output_file)
+        print(f"{count} new TypeForm responses have been added to file '{output_file}'")
+        if flatten_output:
+            flatten(typeform, form_id, output_file)
+        if delete_after_retrieving:
+            delete_synced_responses(typeform, form_id, only_completed_entries, output_file)
+        return
     
-    # retrieve the responses dictionary 
-    dict = fetch_responses_dict(responses, form_id, only_completed_entries)
+    # stream the responses to the output file, or to screen
+    count = typeform.run(export_responses(typeform.client, form_id, only_completed_entries,
+                                          output_file))
     
     if output_file:
-        # write the responses dictionary to an output file
-        write(output_file, dict)
+        print(f"{count} TypeForm responses have been written to file '{output_file}'")
+        if flatten_output:
+            flatten(typeform, form_id, output_file)
     else:
-        # print the responses to screen
-        print(json.dumps(dict, indent = 2))
         print("No responses were written to file, and no responses were deleted.")
         return # don't want to risk deleting responses if not stored
     
     # if True, delete the responses
     if delete_after_retrieving:
-        delete_responses_list(responses, form_id, dict)
+        delete_responses_list(typeform, form_id, read_tokens(output_file), output_file + '.deleted')
         
  
     